@@ -13,7 +13,7 @@ st.markdown(hide_nav_style, unsafe_allow_html=True)
 
 # Sidebar Navigation
 st.sidebar.title("📂 Navigation")
-page = st.sidebar.radio("Go to", ["🏠 Home", "🎯 Moderation on Canvas", "📝 Moderation on Moodle", "📘 Documentation", "🤼‍♂️ Gradebook Resolver"])
+page = st.sidebar.radio("Go to", ["🏠 Home", "🎯 Moderation on Canvas", "📝 Moderation on Moodle", "📘 Documentation", "🤼‍♂️ Gradebook Resolver", "🧩 Merge Gradebooks"])
 
 # Sidebar Footer
 st.sidebar.markdown(
@@ -54,6 +54,8 @@ elif page == "📘 Documentation":
     st.switch_page("pages/Documentation.py")
 elif page == "🤼‍♂️ Gradebook Resolver":
     st.switch_page("pages/Moodle-Gradebook-Resolver.py")
+elif page == "🧩 Merge Gradebooks":
+    st.switch_page("pages/Merge-Gradebooks.py")
 elif page == "🏠 Home":
     st.markdown(
         """
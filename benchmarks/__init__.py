@@ -0,0 +1 @@
+"""Synthetic gradebooks and stage timings for the moderation engines."""
@@ -0,0 +1,305 @@
+"""Peak memory of each page's pipeline on a large synthetic export.
+
+    python -m benchmarks.memory --rows 200000 --output memory.json
+
+Each page runs in a fresh process, so one page's allocations do not hide
+another's. Peaks are growth of the process's resident set, which counts
+pandas' Arrow-backed text columns that tracemalloc does not see. They are
+taken separately for loading the upload and for the rest of the page
+(moderation, reports and the serialized download); on Linux the
+high-water mark is reset in between.
+
+Each page is also run on an export a quarter of the size, and the growth
+of the pipeline peak between the two is given per byte of growth of the
+loaded working frame. Fixed overheads (imports, allocator arenas) cancel
+out, so this marginal ratio is what the page costs per row, in working
+frames.
+
+No page copies its working frame: the uploaded columns are shared by every
+stage. What a page does allocate (float views, result columns, the
+serialized download and the temporaries that build them) is listed with
+its size in PEAK_FRAMES, and each page's budget is the sum of its list.
+Items that are not alive at the same time make the sum an upper bound, but
+every list stays within one frame of the measured peak, so a change that
+makes a page hold another copy of its frame through its peak goes over.
+The process exits with status 1 if any page does; tests/test_memory.py
+runs the same check.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from engine import canvas, export, ingest, memo, merge, moodle, numeric, resolver
+
+DEFAULT_ROWS = 200_000
+# Children run from the repository root so benchmarks and engine import
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The smaller export the marginal ratio is taken against, as a fraction of --rows
+BASE_FRACTION = 4
+
+# What each page allocates beyond its loaded frame, in frames of the synthetic
+# export: a Canvas row is about 40 bytes, a Moodle row about 70 (15 mostly
+# categorical columns), and a float view costs 10 bytes per coerced cell
+PEAK_FRAMES = {
+    "canvas": [
+        (0.75, "float views of the 3 score columns"),
+        (1.5, "result: adjusted total, note and comment columns, new and current scores, missing flags"),
+        (0.5, "export: the adjusted column written as two-decimal text"),
+        (1.0, "transient: that column's Python strings before pandas stores them as Arrow text"),
+        (1.5, "the serialized CSV download, 1.45 frames of text"),
+    ],
+    "moodle": [
+        (0.5, "float views of the 3 score columns"),
+        (1.5, "threshold-35 result: added columns, the update column as objects, float matrix, change log"),
+        (1.0, "threshold-0 result behind the What-If curve; it shares the float matrix"),
+        (0.75, "export: the row filter copies the 65% of students with every score"),
+        (1.0, "the serialized CSV download (0.9 frames) and change log download (0.2)"),
+        (0.75, "transient: to_csv's buffers as each download is written"),
+    ],
+    "resolver": [
+        (1.25, "float views of the 9 duplicate score columns"),
+        (0.5, "the resolved columns"),
+        (1.25, "the score columns side by side while a strategy reduces them (1.0 frame), freed "
+               "before the serialized CSV download (1.2) is written"),
+        (0.5, "transient: to_csv's buffer as it grows"),
+    ],
+    # Merge peaks while matching students; all of it is freed before the merged frame (which
+    # shares the first file's columns) and its CSV download, 1.8 frames together, are built
+    "merge": [
+        (1.0, "every file's normalized keys as Arrow text, 0.95 frames"),
+        (0.75, "factorize()'s distinct keys (0.45 frames) and codes (0.25)"),
+        (1.25, "transient: the keys concatenated, and the stripped and lower-cased copies they are built from"),
+    ],
+}
+# Growth of the pipeline peak allowed per byte of working frame growth
+PEAK_BUDGET = {page: sum(frames for frames, _ in items) for page, items in PEAK_FRAMES.items()}
+
+
+def _max_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _status(field):
+    with open("/proc/self/status") as handle:
+        for line in handle:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} not in /proc/self/status")
+
+
+def _reset_peak():
+    # Linux lets a process reset its high-water mark; elsewhere the peak only grows,
+    # so a phase that stays below an earlier one reports no growth
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+        return _status("VmRSS"), lambda: _status("VmHWM")
+    except OSError:
+        return _max_rss(), _max_rss
+
+
+class PeakRecorder:
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start, peak = _reset_peak()
+        yield
+        self.phases[name] = max(peak() - start, 0)
+
+
+def canvas_page(rec, files):
+    (name, data), = files.items()
+    with rec.phase("load"):
+        df, digest = ingest.load_bytes(data, name)
+    with rec.phase("pipeline"):
+        _canvas(df, digest)
+    return df
+
+
+def _canvas(df, digest):
+    result = canvas.moderate_section(df, "Cohort 01", ["CA1", "CA2", "Exam"], "Exam", 35)
+    canvas.comment_counts(result), canvas.section_counts(result)
+    canvas.adjusted_details(result), canvas.missing_assessments(result)
+    export.export_bytes(digest, "csv", lambda: canvas.export_frame(result))
+
+
+def moodle_page(rec, files):
+    (name, data), = files.items()
+    with rec.phase("load"):
+        df, digest = ingest.load_bytes(data, name)
+    with rec.phase("pipeline"):
+        _moodle(df, digest)
+    return df
+
+
+def _moodle(df, digest):
+    columns = ["Quiz", "Assignment", "Exam"]
+    result = moodle.moderate_cached(df, digest, columns, "Exam", 35)
+    moodle.build_summary(result), moodle.preview_frame(result).head()
+    moodle.moderated_list(result), moodle.status_comparison(result), moodle.grade_comparison(result)
+    moodle.threshold_sweep_cached(df, digest, columns, "Exam")
+    numeric.failed_cells(df, columns, ingest.MOODLE_PLACEHOLDERS)
+    key = moodle.result_key(digest, columns, "Exam", 35)
+    export.export_bytes(key, "csv", lambda: moodle.export_frame(result))
+    export.export_bytes(memo.fingerprint(key, "audit"), "csv", lambda: moodle.audit_frame(result))
+
+
+def resolver_page(rec, files):
+    (name, data), = files.items()
+    with rec.phase("load"):
+        df, digest = ingest.load_bytes(data, name)
+    with rec.phase("pipeline"):
+        _resolver(df, digest)
+    return df
+
+
+def _resolver(df, digest):
+    groups = resolver.default_groups(resolver.detect_duplicates(df.columns))
+    resolved = resolver.resolve(df, groups)
+    resolved.head(20)
+    export.export_bytes(digest, "csv", lambda: resolver.final_frame(resolved, groups))
+
+
+def merge_page(rec, files):
+    frames, digests = {}, []
+    with rec.phase("load"):
+        for name, data in files.items():
+            df, digest = ingest.load_bytes(data, name)
+            frames[name] = df
+            digests.append(digest)
+    # The merged frame is the page's one working frame
+    with rec.phase("pipeline"):
+        key_columns = merge.IDENTITY_KEYS["Email address"]
+        result = merge.merge_cached(frames, digests, key_columns)
+        export.export_bytes(merge.merge_key(digests, key_columns), "csv", lambda: result.df)
+    return result.df
+
+
+def _split(df, parts=2):
+    # Partial exports of one course: every file has the identity columns and some of the scores
+    identity = [col for col in df.columns if col in ingest.IDENTITY_COLUMNS]
+    scores = [col for col in df.columns if col not in identity]
+    return [df[identity + list(chunk)] for chunk in np.array_split(scores, parts)]
+
+
+def _inputs(page, rows, seed):
+    if page == "canvas":
+        return {"canvas.csv": synthetic.to_csv_bytes(synthetic.canvas_gradebook(rows, seed=seed))}
+    df = synthetic.moodle_gradebook(rows, seed=seed)
+    if page == "merge":
+        return {f"part{i + 1}.csv": synthetic.to_csv_bytes(part) for i, part in enumerate(_split(df))}
+    return {f"{page}.csv": synthetic.to_csv_bytes(df)}
+
+
+PAGES = {"canvas": canvas_page, "moodle": moodle_page, "resolver": resolver_page, "merge": merge_page}
+
+
+def measure(page, paths):
+    # Runs in the child process; the uploads are read before the baseline is taken
+    files = {}
+    for path in paths:
+        with open(path, "rb") as handle:
+            files[os.path.basename(path)] = handle.read()
+    rec = PeakRecorder()
+    frame = PAGES[page](rec, files)
+    return {
+        "page": page,
+        "input_bytes": sum(len(data) for data in files.values()),
+        "frame_bytes": memo.frame_nbytes(frame),
+        "load_peak_bytes": rec.phases["load"],
+        "peak_bytes": rec.phases["pipeline"],
+    }
+
+
+def run_page(page, rows, seed):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for name, data in _inputs(page, rows, seed).items():
+            path = os.path.join(folder, name)
+            with open(path, "wb") as handle:
+                handle.write(data)
+            paths.append(path)
+        # Arrow's memory pool and glibc's adaptive mmap threshold keep freed buffers in the
+        # resident set; without them the peak is the live allocations and repeats run to run
+        env = {**os.environ, "ARROW_DEFAULT_MEMORY_POOL": "system", "MALLOC_MMAP_THRESHOLD_": "131072"}
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.memory", "--child", page, *paths],
+            check=True, capture_output=True, text=True, env=env, cwd=ROOT
+        ).stdout
+    return {"rows": rows, **json.loads(output)}
+
+
+def marginal(page, rows, seed):
+    # Peak growth per byte of frame growth between a quarter-size export and the full one
+    base, full = run_page(page, rows // BASE_FRACTION, seed), run_page(page, rows, seed)
+    frame_growth = full["frame_bytes"] - base["frame_bytes"]
+    ratio = (full["peak_bytes"] - base["peak_bytes"]) / frame_growth if frame_growth > 0 else None
+    return {
+        **full,
+        "base_rows": base["rows"],
+        "base_peak_bytes": base["peak_bytes"],
+        "marginal_ratio": None if ratio is None else round(ratio, 2),
+        "budget_ratio": PEAK_BUDGET[page],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.memory", description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="students in the synthetic export")
+    parser.add_argument("--pages", nargs="+", choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.child:
+        page, *paths = options.child
+        print(json.dumps(measure(page, paths)))
+        return 0
+
+    results = []
+    for page in options.pages:
+        print(f"{page}: {options.rows:,} rows", file=sys.stderr)
+        results.append(marginal(page, options.rows, options.seed))
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+    over = [r["page"] for r in results if r["marginal_ratio"] is not None and r["marginal_ratio"] > r["budget_ratio"]]
+    if over:
+        print(f"Peak memory over budget: {', '.join(over)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Time each stage of the Canvas, Moodle and Resolver pipelines.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 1000000 --output bench.json
+
+Each pipeline is run once for timing and once under tracemalloc for peak
+memory, so tracing overhead does not distort the timings. Results are
+written as JSON.
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from engine import canvas, export, moodle, resolver
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+class StageRecorder:
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def run(self, name, fn, *args):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        value = fn(*args)
+        elapsed = time.perf_counter() - start
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.stages[name] = {"peak_bytes": peak - before}
+        else:
+            self.stages[name] = {"seconds": elapsed}
+        return value
+
+
+def canvas_pipeline(rec, data, options):
+    df = rec.run("parse", lambda: pd.read_csv(io.BytesIO(data)))
+    result = rec.run("adjust", canvas.moderate_section, df, "Cohort 01", ["CA1", "CA2", "Exam"], "Exam", 35)
+    rec.run("report", lambda: (canvas.comment_counts(result), canvas.missing_assessments(result),
+                               canvas.adjusted_details(result)))
+    rec.run("export_csv", lambda: export.to_csv_bytes(canvas.export_frame(result)))
+
+
+def moodle_pipeline(rec, data, options):
+    df = rec.run("parse", lambda: pd.read_csv(io.BytesIO(data)))
+    result = rec.run("moderate", moodle.moderate, df, ["Quiz", "Assignment", "Exam"], "Exam", 35)
+    rec.run("report", lambda: (moodle.build_summary(result), moodle.moderated_list(result),
+                               moodle.status_comparison(result), moodle.grade_comparison(result)))
+    frame = rec.run("export_frame", moodle.export_frame, result)
+    rec.run("export_csv", export.to_csv_bytes, frame)
+    if options.xlsx:
+        rec.run("export_xlsx", export.to_xlsx_bytes, frame, "Moderated Results")
+
+
+def resolver_pipeline(rec, data, options):
+    df = rec.run("parse", lambda: pd.read_csv(io.BytesIO(data)))
+    duplicates = rec.run("detect", resolver.detect_duplicates, df.columns)
+    groups = resolver.default_groups(duplicates)
+    resolved = rec.run("resolve", resolver.resolve, df, groups)
+    final = rec.run("final_frame", resolver.final_frame, resolved, groups)
+    rec.run("export_csv", export.to_csv_bytes, final)
+
+
+PIPELINES = {
+    "canvas": (canvas_pipeline, synthetic.canvas_gradebook),
+    "moodle": (moodle_pipeline, synthetic.moodle_gradebook),
+    "resolver": (resolver_pipeline, synthetic.moodle_gradebook),
+}
+
+
+def measure(pipeline, data, rows, options):
+    timing = StageRecorder(trace_memory=False)
+    pipeline(timing, data, options)
+
+    memory = StageRecorder(trace_memory=True)
+    tracemalloc.start()
+    try:
+        pipeline(memory, data, options)
+    finally:
+        tracemalloc.stop()
+
+    stages = {}
+    for name, timed in timing.stages.items():
+        seconds = timed["seconds"]
+        stages[name] = {
+            "seconds": round(seconds, 6),
+            "rows_per_second": round(rows / seconds) if seconds else None,
+            "peak_bytes": memory.stages[name]["peak_bytes"],
+        }
+    total = sum(stage["seconds"] for stage in stages.values())
+    return {
+        "stages": stages,
+        "total_seconds": round(total, 6),
+        "rows_per_second": round(rows / total) if total else None,
+        "peak_bytes": max(stage["peak_bytes"] for stage in stages.values()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="row counts to benchmark")
+    parser.add_argument("--pipelines", nargs="+", choices=sorted(PIPELINES), default=sorted(PIPELINES))
+    parser.add_argument("--xlsx", action="store_true", help="also time Excel export of the Moodle result")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    options = parser.parse_args(argv)
+
+    results = []
+    for rows in options.sizes:
+        for name in options.pipelines:
+            pipeline, generate = PIPELINES[name]
+            data = synthetic.to_csv_bytes(generate(rows, seed=options.seed))
+            print(f"{name}: {rows:,} rows", file=sys.stderr)
+            results.append({"pipeline": name, "rows": rows, "input_bytes": len(data), **measure(pipeline, data, rows, options)})
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Cold-start time of each page.
+
+    python -m benchmarks.startup --repeat 3 --output startup.json
+
+Each measurement runs in a fresh Python process, as on a newly started
+container. The landing page (app.py) is run first, then the page is
+opened from it and timed on its first run with no upload: the time the
+page takes before it can show anything. The heavy libraries the page
+imported on the way are listed with it.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = {
+    "app": None,
+    "documentation": "pages/Documentation.py",
+    "canvas": "pages/Moderate.py",
+    "moodle": "pages/Moodle_moderation.py",
+    "resolver": "pages/Moodle-Gradebook-Resolver.py",
+    "merge": "pages/Merge-Gradebooks.py",
+}
+
+# Libraries worth knowing about when a page starts slowly
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "plotly.express", "matplotlib.pyplot", "xlsxwriter", "sklearn"]
+
+
+def measure(page):
+    # Runs in the child process
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    imported = time.perf_counter() - start
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    seconds = time.perf_counter() - start
+    before = set(sys.modules)
+
+    if PAGES[page] is not None:
+        at.switch_page(PAGES[page])
+        start = time.perf_counter()
+        at.run()
+        seconds = time.perf_counter() - start
+        before = before if page != "app" else set()
+
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules and (PAGES[page] is None or name not in before)]
+    return {
+        "page": page,
+        "streamlit_import_seconds": round(imported, 4),
+        "first_run_seconds": round(seconds, 4),
+        "exceptions": [e.message for e in at.exception],
+        "heavy_imports": loaded,
+    }
+
+
+def run_page(page):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", page],
+        check=True, capture_output=True, text=True, cwd=ROOT
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="+", choices=list(PAGES), default=list(PAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts per page; the median is reported")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+
+    if options.child:
+        print(json.dumps(measure(options.child)))
+        return 0
+
+    results = []
+    for page in options.pages:
+        print(f"{page}: {options.repeat} cold starts", file=sys.stderr)
+        runs = [run_page(page) for _ in range(options.repeat)]
+        results.append({
+            **runs[0],
+            "first_run_seconds": statistics.median(run["first_run_seconds"] for run in runs),
+            "streamlit_import_seconds": statistics.median(run["streamlit_import_seconds"] for run in runs),
+        })
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w") as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Synthetic Canvas and Moodle gradebook exports.
+
+Frames mimic real exports: text identity columns, a ``Section`` column,
+score columns with blank cells, Moodle's "-" placeholders and duplicated
+assessment columns suffixed ``.1``, ``.2`` (how pandas reads repeated
+headers).
+"""
+import numpy as np
+import pandas as pd
+
+CANVAS_SCORES = {"CA1": 15, "CA2": 15, "Exam": 70}
+MOODLE_SCORES = {"Quiz": 20, "Assignment": 20, "Exam": 60}
+
+
+def _names(rng, n, prefix):
+    return pd.Series(rng.integers(0, 5_000, n)).map(lambda i: f"{prefix}{i:04d}")
+
+
+def _scores(rng, n, maximum, missing=0.06, decimals=True):
+    values = rng.triangular(0, maximum * 0.65, maximum, n)
+    values = np.round(values * 2) / 2 if decimals else np.round(values)
+    values[rng.random(n) < missing] = np.nan
+    return values
+
+
+def canvas_gradebook(n, sections=20, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Student": _names(rng, n, "Student "),
+        "ID": np.arange(100_000, 100_000 + n),
+        "SIS User ID": [f"MIVA/{i:07d}" for i in range(n)],
+        "Section": rng.choice([f"Cohort {i + 1:02d}" for i in range(sections)], n),
+    })
+    for col, maximum in CANVAS_SCORES.items():
+        df[col] = _scores(rng, n, maximum)
+    return df
+
+
+def moodle_gradebook(n, duplicates=3, placeholder_rate=0.08, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "First name": _names(rng, n, "First"),
+        "Last name": _names(rng, n, "Last"),
+        "ID number": [f"MIVA/{i:07d}" for i in range(n)],
+        "Email address": [f"student{i}@miva.edu.ng" for i in range(n)],
+    })
+    for col, maximum in MOODLE_SCORES.items():
+        values = _scores(rng, n, maximum).astype(object)
+        values[rng.random(n) < placeholder_rate] = "-"
+        df[col] = values
+
+    # Repeated quiz attempts: each student usually sits only some of them
+    for q in range(duplicates):
+        for suffix in ["", ".1", ".2"]:
+            values = _scores(rng, n, 10, missing=0.5).astype(object)
+            values[rng.random(n) < placeholder_rate] = "-"
+            df[f"Quiz {q + 1}: Weekly check{suffix}"] = values
+    return df
+
+
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode("utf-8")
@@ -0,0 +1,8 @@
+"""UI-free moderation logic shared by the Streamlit pages."""
+import pandas as pd
+
+# Frames are passed between stages as shallow copies and views, which is only
+# safe with copy-on-write: a column written in one frame never shows through
+# another. pandas 3 always works this way; 2.x needs the option.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
@@ -0,0 +1,240 @@
+"""Canvas score adjustment engine.
+
+Column-wise replacement for the per-student ``adjust_row`` in
+pages/Moderate.py: totals, shortfalls, capped adjustments and the
+"Adjusted by X" notes are computed for a whole section at once.
+"""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from engine import numeric
+from engine.instrument import stage
+
+PASS_MARK = 40
+COMMENTS = ["Adjusted", "Pass", "Fail", "Assessment not taken"]
+
+# Working columns added by moderate_section() that are dropped from the export
+HELPER_COLS = ["Adjusted Total", "Adjustment Note", "comment"]
+
+
+def _row_sum(matrix):
+    # Left-to-right accumulation, as Series.sum() did on each student's row
+    total = np.zeros(matrix.shape[0])
+    for j in range(matrix.shape[1]):
+        total = total + matrix[:, j]
+    return total
+
+
+def _integer_rows(frame, score_columns, int_columns, matrix):
+    # adjust_row saw whole rows, so the shortfall printed as an int ("Adjusted by 3")
+    # whenever every filled score in the row was an int: a mixed-dtype row keeps
+    # each cell's type (and fillna(0) adds int zeros), an all-numeric row is upcast
+    is_int = pd.api.types.is_integer_dtype
+    other_dtypes = [dtype for col, dtype in frame.dtypes.items() if col not in score_columns]
+    if all(pd.api.types.is_numeric_dtype(d) for d in other_dtypes):
+        return np.full(len(matrix), all(is_int(d) for d in other_dtypes) and bool(int_columns.all()))
+    return (int_columns | np.isnan(matrix)).all(axis=1)
+
+
+def adjust_scores(frame, score_columns, threshold, rows=None):
+    """Adjusted totals and notes for rows of ``frame`` with all scores present.
+
+    ``rows`` picks row positions of ``frame``; by default every row is adjusted.
+    """
+    view = numeric.view(frame)
+    if rows is None:
+        rows = np.arange(len(frame))
+    matrix = view.matrix(score_columns, rows)
+    integer = _integer_rows(frame, score_columns, view.integer_columns(score_columns, rows), matrix)
+
+    values = np.nan_to_num(matrix, nan=0.0)
+    total = _row_sum(values)
+    adjust = (total >= threshold) & (total < PASS_MARK)
+
+    # Shortfall is added to the last selected column, capped at the pass mark
+    shortfall = PASS_MARK - total[adjust]
+    values[adjust, -1] = np.minimum(values[adjust, -1] + shortfall, PASS_MARK)
+    adjusted_total = total.copy()
+    adjusted_total[adjust] = _row_sum(values[adjust])
+
+    notes = np.full(len(rows), "No adjustment needed", dtype=object)
+    notes[adjust] = [
+        f"Adjusted by {int(s) if is_int else s}"
+        for s, is_int in zip(shortfall.tolist(), integer[adjust].tolist())
+    ]
+
+    return pd.DataFrame({"Adjusted Total": adjusted_total, "Adjustment Note": notes}, index=frame.index[rows])
+
+
+_COMMENT_LABELS = np.array(COMMENTS, dtype=object)
+
+
+def _classify(updated_df, missing):
+    note = updated_df["Adjustment Note"]
+    conditions = [
+        note.str.startswith("Adjusted by", na=False).to_numpy(),
+        (note.eq("No adjustment needed") & (updated_df["Adjusted Total"] >= PASS_MARK)).to_numpy(),
+        missing.any(axis=1).to_numpy(),
+    ]
+    # Codes into one array of labels, rather than a fixed-width string per student
+    codes = np.select(conditions, [0, 1, 3], default=2)
+    return _COMMENT_LABELS[codes]
+
+
+@dataclass
+class CanvasResult:
+    df: pd.DataFrame            # input frame plus Adjusted Total, Adjustment Note and comment
+    section_mask: pd.Series
+    score_columns: list
+    column_to_be_adjusted: str
+    new_scores: pd.Series       # moderated value for column_to_be_adjusted
+    current: pd.Series          # column_to_be_adjusted as numbers, before moderation
+    missing: pd.DataFrame       # per-cell "assessment not taken" flags for score_columns
+
+
+def moderate_section(df, section, score_columns, column_to_be_adjusted, threshold, require_valid=True):
+    """Adjust the students of ``section``; ``section=None`` moderates every section at once."""
+    score_columns = list(score_columns)
+    section_mask = df["Section"].notna() if section is None else df["Section"] == section
+
+    # Keep only rows that have values in all selected score_columns
+    valid = section_mask.to_numpy() & df[score_columns].notna().to_numpy().all(axis=1)
+    rows = np.flatnonzero(valid)
+    if require_valid and len(rows) == 0:
+        raise ValueError("No students in this section have a value in every selected score column.")
+
+    with stage("adjust"):
+        adjusted = adjust_scores(df, score_columns, threshold, rows)
+
+    adjusted_total = np.full(len(df), np.nan)
+    adjusted_total[rows] = adjusted["Adjusted Total"].to_numpy()
+    notes = np.full(len(df), np.nan, dtype=object)
+    notes[rows] = adjusted["Adjustment Note"].to_numpy()
+
+    updated_df = df.copy(deep=False)
+    updated_df["Adjusted Total"] = adjusted_total
+    updated_df["Adjustment Note"] = notes
+
+    # Coerced once per frame and shared with the adjustment above
+    view = numeric.view(df)
+    current = view.series(column_to_be_adjusted)
+    others = [col for col in score_columns if col != column_to_be_adjusted]
+    new_scores = pd.Series(adjusted_total - _row_sum(np.nan_to_num(view.matrix(others), nan=0.0)), index=df.index)
+
+    # The adjusted column counts as missing once coerced; the others only when blank
+    missing = df[score_columns].isna()
+    missing[column_to_be_adjusted] = current.isna()
+
+    with stage("classify"):
+        updated_df["comment"] = _classify(updated_df, missing)
+
+    return CanvasResult(
+        df=updated_df,
+        section_mask=section_mask,
+        score_columns=score_columns,
+        column_to_be_adjusted=column_to_be_adjusted,
+        new_scores=new_scores,
+        current=current,
+        missing=missing,
+    )
+
+
+# --- Reporting ---
+def comment_counts(result):
+    return result.df.loc[result.section_mask, "comment"].value_counts()
+
+
+def section_counts(result):
+    # Per-section dashboard in one grouped pass: Total plus a column per comment
+    df = result.df.loc[result.section_mask]
+    table = pd.crosstab(df["Section"], df["comment"]).reindex(columns=COMMENTS, fill_value=0)
+    table.columns.name = None
+    table.insert(0, "Total", table.sum(axis=1))
+    return table
+
+
+def adjusted_details(result):
+    # Adjusted students plus everyone in the section who still failed
+    df = result.df
+    return df[(df["comment"] == "Adjusted") | result.section_mask & (df["comment"] == "Fail")]
+
+
+def missing_assessments(result):
+    missing_counts = result.missing[result.section_mask].sum()
+    return pd.DataFrame({
+        "Assessment Type": missing_counts.index,
+        "Number of Students": missing_counts.values
+    })
+
+
+def _two_decimals(values):
+    return values.map(lambda x: f"{x:.2f}" if pd.notnull(x) else x).astype(object)
+
+
+def export_frame(result):
+    col = result.column_to_be_adjusted
+    current = result.current
+    export = result.df.drop(columns=HELPER_COLS)
+    export[col] = np.where(result.new_scores > current, _two_decimals(result.new_scores), _two_decimals(current))
+    return export
+
+
+# --- Streaming ---
+# Rows per chunk when streaming; peak memory is a small multiple of one chunk
+STREAM_CHUNK_ROWS = 50_000
+# Adjusted/failed students kept for display while streaming
+STREAM_DETAIL_ROWS = 1_000
+
+
+@dataclass
+class StreamSummary:
+    rows: int = 0
+    valid_rows: int = 0
+    counts: pd.Series = field(default_factory=lambda: pd.Series(dtype="int64"))
+    missing: pd.Series = field(default_factory=lambda: pd.Series(dtype="int64"))
+    details: pd.DataFrame = field(default_factory=pd.DataFrame)
+    sections: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+
+def scan_sections(source, chunksize=STREAM_CHUNK_ROWS):
+    # Only the Section column is parsed, read as text like the streamed chunks
+    sections = set()
+    for chunk in pd.read_csv(source, usecols=["Section"], dtype=str, chunksize=chunksize):
+        sections.update(chunk["Section"].dropna().unique())
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return sorted(sections)
+
+
+def stream_section(source, output, section, score_columns, column_to_be_adjusted, threshold,
+                   chunksize=STREAM_CHUNK_ROWS):
+    """Moderate a Canvas CSV chunk by chunk, appending each exported chunk to ``output``.
+
+    ``section=None`` moderates every section, as in moderate_section().
+
+    Cells are read as text, so columns that are not moderated are written back
+    exactly as they appeared in the source file.
+    """
+    summary = StreamSummary(missing=pd.Series(0, index=list(score_columns)))
+    details = []
+    for i, chunk in enumerate(pd.read_csv(source, dtype=str, chunksize=chunksize)):
+        result = moderate_section(chunk, section, score_columns, column_to_be_adjusted, threshold, require_valid=False)
+        export_frame(result).to_csv(output, index=False, header=(i == 0))
+
+        summary.rows += len(chunk)
+        summary.valid_rows += int(result.df["Adjustment Note"].notna().sum())
+        summary.counts = summary.counts.add(comment_counts(result), fill_value=0).astype("int64")
+        summary.missing += result.missing[result.section_mask].sum()
+        summary.sections = summary.sections.add(section_counts(result), fill_value=0)
+        kept = sum(len(d) for d in details)
+        if kept < STREAM_DETAIL_ROWS:
+            details.append(adjusted_details(result).head(STREAM_DETAIL_ROWS - kept))
+
+    if summary.valid_rows == 0:
+        raise ValueError("No students in this section have a value in every selected score column.")
+    summary.counts = summary.counts.sort_values(ascending=False)
+    summary.sections = summary.sections.reindex(columns=["Total"] + COMMENTS).astype("int64")
+    summary.details = pd.concat(details)
+    return summary
@@ -0,0 +1,222 @@
+"""Headless batch moderation.
+
+Runs the same engine code as the Streamlit pages over many exports at once,
+one file per worker process::
+
+    python -m engine.cli moodle exports/ --columns Quiz Assignment Exam --update-field Exam --threshold 35
+    python -m engine.cli canvas "exports/*.csv" --section "Cohort A" --columns CA1 CA2 Exam --adjust-column Exam
+    python -m engine.cli canvas exports/ --all-sections --columns CA1 CA2 Exam --adjust-column Exam
+    python -m engine.cli resolve site_export.csv --strategy last
+
+Each input produces a moderated file and a ``<name>_summary.csv`` in the
+output directory, plus one ``batch_summary.csv`` covering every file.
+"""
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from engine import canvas, export, ingest, moodle, resolver
+
+INPUT_EXTENSIONS = (".csv", ".xlsx")
+
+
+def expand_inputs(patterns):
+    # Directories contribute every CSV/XLSX they contain; anything else is a glob
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern))]
+        else:
+            matches = sorted(glob.glob(pattern))
+        paths.extend(p for p in matches if p.lower().endswith(INPUT_EXTENSIONS))
+    return list(dict.fromkeys(paths))
+
+
+def write_frame(df, path, fmt):
+    if fmt == "xlsx":
+        export.write_xlsx(df, path, "Moderated Results")
+    else:
+        df.to_csv(path, index=False)
+
+
+def moderate_moodle_file(df, options):
+    result = moodle.moderate(df, options["columns"], options["update_field"], options["threshold"])
+    summary = moodle.build_summary(result)
+    status = result.df["Status"].value_counts()
+    record = {
+        "students": len(df),
+        "moderated": result.further_count,
+        "pass": int(status.get("Pass", 0)),
+        "fail": int(status.get("Fail", 0)),
+    }
+    return moodle.export_frame(result), summary, record, "ModeratedResults"
+
+
+def _section(options):
+    # None selects every section
+    return None if options.get("all_sections") else options["section"]
+
+
+def moderate_canvas_file(df, options):
+    result = canvas.moderate_section(
+        df, _section(options), options["columns"], options["adjust_column"], options["threshold"]
+    )
+    counts = canvas.comment_counts(result)
+    summary = canvas.section_counts(result).reset_index()
+    record = {
+        "students": int(counts.sum()),
+        "moderated": int(counts.get("Adjusted", 0)),
+        "pass": int(counts.get("Pass", 0)),
+        "fail": int(counts.get("Fail", 0)),
+    }
+    return canvas.export_frame(result), summary, record, "updated"
+
+
+def stream_canvas_file(path, output, options):
+    try:
+        with open(output, "w", newline="") as handle:
+            summary = canvas.stream_section(
+                path, handle, _section(options), options["columns"], options["adjust_column"], options["threshold"],
+                chunksize=options["chunksize"]
+            )
+    except Exception:
+        # No half-written file is left behind for a failed export
+        os.remove(output)
+        raise
+    counts = summary.counts
+    record = {
+        "students": int(counts.sum()),
+        "moderated": int(counts.get("Adjusted", 0)),
+        "pass": int(counts.get("Pass", 0)),
+        "fail": int(counts.get("Fail", 0)),
+    }
+    return summary.sections.reset_index(), record
+
+
+def resolve_file(df, options):
+    duplicates = resolver.detect_duplicates(df.columns)
+    groups = resolver.default_groups(duplicates, options["strategy"])
+    final = resolver.final_frame(resolver.resolve(df, groups), groups)
+    record = {"students": len(df), "groups": len(groups)}
+    return final, resolver.group_table(duplicates), record, "resolved"
+
+
+def stream_resolve_file(path, output, options):
+    duplicates = resolver.detect_duplicates(ingest.read_header(path))
+    groups = resolver.default_groups(duplicates, options["strategy"])
+    try:
+        with open(output, "w", newline="") as handle:
+            summary = resolver.stream_resolve(path, handle, groups, chunksize=options["chunksize"])
+    except Exception:
+        os.remove(output)
+        raise
+    record = {"students": summary.rows, "groups": len(groups)}
+    return resolver.group_table(duplicates), record
+
+
+MODERATORS = {
+    "moodle": moderate_moodle_file,
+    "canvas": moderate_canvas_file,
+    "resolve": resolve_file,
+}
+# Streaming counterparts for CSV inputs, with the output file suffix
+STREAMERS = {
+    "canvas": (stream_canvas_file, "updated"),
+    "resolve": (stream_resolve_file, "resolved"),
+}
+
+
+def run_file(path, options):
+    """Moderate one export; failures are reported in the record, not raised."""
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    record = {"file": path, "status": "ok", "output": "", "error": ""}
+    try:
+        if options.get("chunksize") and ingest.is_csv(path):
+            # Streaming: bounded memory, CSV in and CSV out
+            stream, suffix = STREAMERS[options["platform"]]
+            output = os.path.join(options["output_dir"], f"{base_name}_{suffix}.csv")
+            summary, counts = stream(path, output, options)
+        else:
+            df = ingest.read_path(path)
+            export, summary, counts, suffix = MODERATORS[options["platform"]](df, options)
+            output = os.path.join(options["output_dir"], f"{base_name}_{suffix}.{options['format']}")
+            write_frame(export, output, options["format"])
+        summary.to_csv(os.path.join(options["output_dir"], f"{base_name}_summary.csv"), index=False)
+        record.update(counts, output=output)
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    return record
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m engine.cli", description="Moderate gradebook exports in batch.")
+    subparsers = parser.add_subparsers(dest="platform", required=True)
+
+    def add_common(sub, columns=True):
+        sub.add_argument("inputs", nargs="+", help="CSV/XLSX files, directories or glob patterns")
+        if columns:
+            sub.add_argument("--columns", nargs="+", required=True, help="columns used for the total score")
+        sub.add_argument("-o", "--output-dir", default="moderated", help="where moderated files are written")
+        sub.add_argument("--format", choices=["csv", "xlsx"], default="csv", help="output file format")
+        sub.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+
+    moodle_parser = subparsers.add_parser("moodle", help="Moodle moderation (boundary + further moderation)")
+    add_common(moodle_parser)
+    moodle_parser.add_argument("--update-field", required=True, help="column updated with the moderated score")
+    moodle_parser.add_argument("--threshold", type=int, default=0, help="threshold for further moderation (0 for none)")
+
+    canvas_parser = subparsers.add_parser("canvas", help="Canvas section adjustment")
+    add_common(canvas_parser)
+    sections = canvas_parser.add_mutually_exclusive_group(required=True)
+    sections.add_argument("--section", help="value of the Section column to moderate")
+    sections.add_argument("--all-sections", action="store_true", help="moderate every section in one pass")
+    canvas_parser.add_argument("--adjust-column", required=True, help="column to be updated")
+    canvas_parser.add_argument("--threshold", type=int, default=40, help="minimum threshold score")
+    canvas_parser.add_argument(
+        "--chunksize", type=int, default=None,
+        help=f"stream CSV inputs in chunks of this many rows (e.g. {canvas.STREAM_CHUNK_ROWS}); output is always CSV"
+    )
+
+    resolve_parser = subparsers.add_parser("resolve", help="Gradebook Resolver (merge duplicate Moodle columns)")
+    add_common(resolve_parser, columns=False)
+    resolve_parser.add_argument(
+        "--strategy", choices=list(resolver.STRATEGIES), default=resolver.DEFAULT_STRATEGY,
+        help="how each duplicate group is resolved"
+    )
+    resolve_parser.add_argument(
+        "--chunksize", type=int, default=resolver.STREAM_CHUNK_ROWS,
+        help="CSV inputs are resolved in chunks of this many rows; output is always CSV"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No CSV or XLSX files matched the given inputs.", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {key: value for key, value in vars(args).items() if key not in ("inputs", "jobs")}
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        records = list(pool.map(run_file, paths, [options] * len(paths)))
+
+    batch = pd.DataFrame(records)
+    batch.to_csv(os.path.join(args.output_dir, "batch_summary.csv"), index=False)
+    print(batch.to_string(index=False))
+
+    failed = int((batch["status"] != "ok").sum())
+    if failed:
+        print(f"{failed} of {len(paths)} files failed.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""On-demand CSV/XLSX export bytes, cached by result fingerprint.
+
+Download buttons receive ``deferred(...)`` callables, so a file is only
+serialized when the user actually clicks, and a second click (or another
+session with the same result) reuses the cached bytes.
+"""
+import io
+import os
+import tempfile
+import weakref
+
+from engine.memo import LRUCache
+
+CSV_MIME = "text/csv"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MIME_TYPES = {"csv": CSV_MIME, "xlsx": XLSX_MIME}
+
+# Workbooks with at least this many rows are written in xlsxwriter's
+# constant_memory mode, which flushes each row to disk as it is completed
+CONSTANT_MEMORY_ROWS = 20_000
+# Rows converted to Python values at a time while writing a workbook
+XLSX_BATCH_ROWS = 5_000
+
+MAX_EXPORT_BYTES = int(os.environ.get("MODERATOR_EXPORT_CACHE_MB", "256")) * 1024 * 1024
+
+export_cache = LRUCache(MAX_EXPORT_BYTES, sizeof=len)
+
+
+def to_csv_bytes(df):
+    # Written straight to a byte buffer, without first building the whole file as a str
+    output = io.BytesIO()
+    df.to_csv(output, index=False, encoding="utf-8")
+    return output.getvalue()
+
+
+def write_xlsx(df, target, sheet_name="Sheet1"):
+    # Rows are written strictly in order (pandas' to_excel writes column by
+    # column, which constant_memory mode cannot handle). target is a path or binary file
+    import xlsxwriter  # only needed for Excel downloads, so not imported at startup
+
+    options = {"constant_memory": len(df) >= CONSTANT_MEMORY_ROWS}
+    with xlsxwriter.Workbook(target, options) as workbook:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header)
+
+        for start in range(0, len(df), XLSX_BATCH_ROWS):
+            batch = df.iloc[start:start + XLSX_BATCH_ROWS]
+            # Missing values become empty cells, as with to_excel
+            values = batch.astype(object).where(batch.notna(), None).to_numpy().tolist()
+            for offset, row in enumerate(values, start=start + 1):
+                worksheet.write_row(offset, 0, row)
+
+
+def to_xlsx_bytes(df, sheet_name="Sheet1"):
+    output = io.BytesIO()
+    write_xlsx(df, output, sheet_name)
+    return output.getvalue()
+
+
+def export_bytes(key, fmt, build_frame, sheet_name="Sheet1"):
+    """Serialized export for ``key`` in ``fmt``; ``build_frame`` runs only on a cache miss."""
+    cache_key = (key, fmt)
+    data = export_cache.get(cache_key)
+    if data is None:
+        df = build_frame()
+        data = to_xlsx_bytes(df, sheet_name) if fmt == "xlsx" else to_csv_bytes(df)
+        export_cache.put(cache_key, data)
+    return data
+
+
+def deferred(key, fmt, build_frame, sheet_name="Sheet1"):
+    # Zero-argument callable for st.download_button(data=...)
+    return lambda: export_bytes(key, fmt, build_frame, sheet_name)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class TempExport:
+    """A streamed export kept on disk rather than in memory.
+
+    The file is deleted once nothing refers to the TempExport (e.g. when the
+    session state holding it is replaced), or at interpreter exit.
+    """
+
+    def __init__(self, suffix=".csv"):
+        handle, self.path = tempfile.mkstemp(prefix="moderator-", suffix=suffix)
+        os.close(handle)
+        weakref.finalize(self, _remove, self.path)
+
+    def read(self):
+        # Zero-argument callable for st.download_button(data=...): bytes are read only on click
+        with open(self.path, "rb") as handle:
+            return handle.read()
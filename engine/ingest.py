@@ -0,0 +1,211 @@
+"""Upload parsing with a content-hash keyed cache.
+
+Streamlit reruns the page script on every widget change. Parsed frames are
+kept in a process-wide LRU keyed by a hash of the uploaded bytes, so a
+rerun reuses the frame and a new upload (different bytes) is parsed fresh.
+Cached frames are shared between reruns and sessions: treat them as
+read-only and copy before mutating.
+"""
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from engine.instrument import stage
+from engine.memo import LRUCache, frame_nbytes
+
+# Upper bound on the memory held by cached frames
+MAX_CACHE_BYTES = int(os.environ.get("MODERATOR_PARSE_CACHE_MB", "512")) * 1024 * 1024
+
+# Moodle writes "-" for an ungraded cell; it is kept as text in the frame (and
+# so in exports) and only reads as blank when the scores are computed
+MOODLE_PLACEHOLDERS = ("-",)
+# Moodle's identity columns, always loaded alongside the selected scores
+IDENTITY_COLUMNS = ["First name", "Last name", "ID number", "Institution", "Department", "Email address"]
+# Arrow IPC files and streams, accepted by the HTTP API
+ARROW_EXTENSIONS = (".arrow", ".arrows", ".feather")
+# Rows parsed for the preview in projected mode
+PREVIEW_ROWS = 5
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+
+def file_digest(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def is_csv(name):
+    return name.lower().endswith(".csv")
+
+
+def is_arrow(name):
+    return name.lower().endswith(ARROW_EXTENSIONS)
+
+
+def file_format(name):
+    return "csv" if is_csv(name) else "arrow" if is_arrow(name) else "xlsx"
+
+
+def read_arrow(data):
+    # Arrow IPC file (Feather v2) or stream; pyarrow is only needed for Arrow input
+    import pyarrow as pa
+
+    buffer = pa.BufferReader(data)
+    reader = pa.ipc.open_file(buffer) if data[:6] == b"ARROW1" else pa.ipc.open_stream(buffer)
+    return reader.read_pandas()
+
+
+def read_bytes(data, name, usecols=None, nrows=None):
+    if is_csv(name):
+        return pd.read_csv(io.BytesIO(data), usecols=usecols, nrows=nrows)
+    if is_arrow(name):
+        df = read_arrow(data)
+        if usecols is not None:
+            df = df.iloc[:, usecols]
+        return df if nrows is None else df.head(nrows)
+    return pd.read_excel(io.BytesIO(data), usecols=usecols, nrows=nrows)
+
+
+# --- Compact dtypes ---
+def _downcast(series):
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series.dtype) and series.dtype != "float32":
+        # float32 only when every value survives the round trip (e.g. halves,
+        # whole marks); 12.3 would not, and totals must stay exact
+        values = series.to_numpy()
+        compact = values.astype("float32")
+        if np.array_equal(compact.astype(values.dtype), values, equal_nan=True):
+            return pd.Series(compact, index=series.index, name=series.name)
+    return series
+
+
+def _compact_text(series):
+    if series.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(series):
+        return series.astype("category")
+    return series
+
+
+def optimize_frame(df):
+    """Copy of ``df`` with compact dtypes and its memory footprint before/after.
+
+    Integer and float columns are downcast without losing values and repeated
+    text becomes categorical. Score columns holding a placeholder such as "-"
+    are text and are never stored as numbers. Every value writes back out
+    exactly as it was read.
+    """
+    before = frame_nbytes(df)
+    out = df.copy(deep=False)
+    for i in range(out.shape[1]):
+        series = out.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+            compact = _downcast(series)
+        elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+            compact = _compact_text(series)
+        else:
+            continue
+        if compact is not series:
+            out.isetitem(i, compact)
+    out.attrs["memory_before"] = before
+    out.attrs["memory_after"] = frame_nbytes(out)
+    return out
+
+
+def memory_report(df):
+    # "12.0 MB → 3.1 MB (74% saved)" for frames returned by optimize_frame()
+    before, after = df.attrs.get("memory_before"), df.attrs.get("memory_after")
+    if not before:
+        return None
+    return f"{before / 2**20:.1f} MB → {after / 2**20:.1f} MB ({1 - after / before:.0%} saved)"
+
+
+def read_header(source):
+    # Column names only; file-like sources are rewound for the next reader
+    columns = pd.read_csv(source, nrows=0).columns.tolist()
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return columns
+
+
+def read_path(path):
+    if is_csv(path):
+        return pd.read_csv(path)
+    if is_arrow(path):
+        with open(path, "rb") as handle:
+            return read_arrow(handle.read())
+    return pd.read_excel(path)
+
+
+parse_cache = LRUCache(MAX_CACHE_BYTES)
+
+
+def load_bytes(data, name):
+    """Parsed, dtype-compacted frame and content digest for an uploaded file's bytes."""
+    with stage("hash"):
+        digest = file_digest(data)
+    key = (digest, file_format(name))
+    df = parse_cache.get(key)
+    if df is None:
+        with stage("parse"):
+            df = read_bytes(data, name)
+        with stage("optimize"):
+            df = optimize_frame(df)
+        parse_cache.put(key, df)
+    return df, digest
+
+
+def load_upload(uploaded_file):
+    df, _ = load_bytes(uploaded_file.getvalue(), uploaded_file.name)
+    return df
+
+
+# --- Column-projected loading ---
+# Wide gradebooks are loaded in two phases: the header (plus a few preview rows)
+# for the column pickers, then only the identity and selected columns for the
+# computation. The full frame is parsed only when an export needs it.
+def load_preview(data, name, rows=PREVIEW_ROWS):
+    """First ``rows`` rows and the content digest; the columns feed the pickers."""
+    with stage("hash"):
+        digest = file_digest(data)
+    key = (digest, file_format(name), "preview", rows)
+    head = parse_cache.get(key)
+    if head is None:
+        with stage("parse_header"):
+            head = read_bytes(data, name, nrows=rows)
+        parse_cache.put(key, head)
+    return head, digest
+
+
+def projected_columns(header, columns, identity=IDENTITY_COLUMNS):
+    # Identity columns first, then the selected ones, as positions in the header.
+    # Positions (not names) keep pandas' "name.1" labels for repeated headers.
+    wanted = set(identity) | set(columns)
+    return [i for i, col in enumerate(header) if col in wanted]
+
+
+def load_projected(data, name, columns, identity=IDENTITY_COLUMNS):
+    """Identity and ``columns`` only, dtype-compacted, with the content digest."""
+    head, digest = load_preview(data, name)
+    positions = projected_columns(head.columns, columns, identity)
+    key = (digest, file_format(name), "columns", tuple(positions))
+    df = parse_cache.get(key)
+    if df is None:
+        with stage("parse"):
+            df = read_bytes(data, name, usecols=positions)
+        with stage("optimize"):
+            df = optimize_frame(df)
+        parse_cache.put(key, df)
+    return df, digest
+
+
+def rejoin(full, projected):
+    """``full`` with the columns of ``projected`` written over it, in file order.
+
+    Rows are aligned on the index, so ``projected`` may be a row subset.
+    """
+    out = full.loc[projected.index].copy(deep=False)
+    for col in projected.columns.intersection(full.columns):
+        out[col] = projected[col]
+    return out
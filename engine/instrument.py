@@ -0,0 +1,181 @@
+"""Opt-in per-stage timing and memory instrumentation.
+
+Enabled with the ``MODERATOR_PROFILE=1`` environment variable or a
+``?profile=1`` query parameter. Pages start a profiler for each run and
+wrap their steps in ``profiler.stage(...)``; engine code marks its own
+steps with the module-level ``stage(...)``, which records into the active
+profiler and costs nothing when profiling is off.
+
+Memory figures come from tracemalloc, which is process-wide: with several
+sessions profiling at once, their allocations overlap. Tracing starts with
+the first enabled profiler and stops when the last one is garbage collected
+(e.g. its session ends), so other sessions only pay for it meanwhile.
+
+Finished stages are emitted as JSON lines on the ``moderator.profile``
+logger. Set ``MODERATOR_PROFILE_LOG`` to a file path to also append them
+to that file.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+
+import pandas as pd
+
+logger = logging.getLogger("moderator.profile")
+
+_active = contextvars.ContextVar("moderator_profiler", default=None)
+# Called with each stage name as it starts; background jobs use it for progress and cancellation
+stage_hook = contextvars.ContextVar("moderator_stage_hook", default=None)
+_log_lock = threading.Lock()
+_log_configured = False
+# Enabled profilers alive, and whether tracemalloc was started for them
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+def enabled(query_value=None):
+    if query_value is not None and str(query_value).lower() in ("1", "true", "yes", "on"):
+        return True
+    return os.environ.get("MODERATOR_PROFILE", "").lower() in ("1", "true", "yes", "on")
+
+
+def _configure_log():
+    global _log_configured
+    with _log_lock:
+        if _log_configured:
+            return
+        path = os.environ.get("MODERATOR_PROFILE_LOG")
+        if path:
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _log_configured = True
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+
+
+def _stop_tracing():
+    # Only stops tracing this module started, never tracing someone else turned on
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class _Frame:
+    def __init__(self, name, start_bytes):
+        self.name = name
+        self.start_bytes = start_bytes
+        self.max_peak = start_bytes
+
+
+class Profiler:
+    def __init__(self, page, enabled=True):
+        self.page = page
+        self.enabled = enabled
+        self.records = []
+        # Stages run outside the page script (e.g. deferred downloads)
+        self.background = deque(maxlen=20)
+        self._stack = []
+        if enabled:
+            _configure_log()
+            _start_tracing()
+            weakref.finalize(self, _stop_tracing)
+
+    def begin_run(self):
+        self.records = []
+        self._stack = []
+        _active.set(self if self.enabled else None)
+        return self
+
+    @contextlib.contextmanager
+    def stage(self, name, background=False):
+        if not self.enabled:
+            yield
+            return
+
+        # Background stages run on their own thread and never nest in the page's stack
+        stack = [] if background else self._stack
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        frame = _Frame("/".join([f.name for f in stack] + [name]), current)
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame.max_peak)
+            # Inner stages reset the tracemalloc peak, so hand ours to the parent
+            if stack:
+                stack[-1].max_peak = max(stack[-1].max_peak, peak)
+            record = {
+                "page": self.page,
+                "stage": frame.name,
+                "seconds": round(seconds, 6),
+                "allocated_bytes": current - frame.start_bytes,
+                "peak_bytes": peak - frame.start_bytes,
+            }
+            (self.background if background else self.records).append(record)
+            self._log(record)
+
+    def deferred(self, fn, name):
+        # Wrap a callable that runs later on another thread (st.download_button data, background jobs)
+        if not self.enabled:
+            return fn
+
+        def run(*args, **kwargs):
+            with self.stage(name, background=True):
+                return fn(*args, **kwargs)
+        return run
+
+    def frame(self):
+        return pd.DataFrame(self.records, columns=["stage", "seconds", "allocated_bytes", "peak_bytes"])
+
+    def background_frame(self):
+        return pd.DataFrame(list(self.background), columns=["stage", "seconds", "allocated_bytes", "peak_bytes"])
+
+    def _log(self, record):
+        logger.info(json.dumps({"time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), **record}))
+
+
+def session_profiler(state, page, is_enabled):
+    """The page's profiler kept in ``state`` (st.session_state), started for this run."""
+    key = f"profiler_{page}"
+    profiler = state.get(key)
+    if profiler is None or profiler.enabled != is_enabled:
+        profiler = Profiler(page, is_enabled)
+        state[key] = profiler
+    return profiler.begin_run()
+
+
+def stage(name):
+    """Record ``name`` in the active profiler, if any."""
+    hook = stage_hook.get()
+    if hook is not None:
+        hook(name)
+    profiler = _active.get()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name)
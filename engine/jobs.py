@@ -0,0 +1,125 @@
+"""Background jobs for long moderation runs.
+
+A page submits its moderation or resolution as a Job and keeps the Job in
+session state, so the script returns at once and the page stays usable.
+Jobs run on a small process-wide thread pool: results are ordinary frames
+handed straight back to the session, and the engine caches are shared.
+
+Progress comes from the engine's own ``stage(...)`` markers, which a job
+maps to a fraction through the stage names it expects, and from explicit
+``report()`` calls (e.g. streaming progress). Cancelling a job takes
+effect at the next stage marker or report.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from engine import instrument
+
+# Jobs running at once across all sessions; the rest wait their turn
+MAX_JOB_WORKERS = int(os.environ.get("MODERATOR_JOB_WORKERS", "2"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+_pool = ThreadPoolExecutor(max_workers=MAX_JOB_WORKERS, thread_name_prefix="moderator-job")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One background run: its state, progress, and result or error."""
+
+    def __init__(self, name, key=None, stages=()):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.key = key                  # what the result is for, e.g. a params fingerprint
+        self.stages = list(stages)      # engine stages expected, in order
+        self.state = QUEUED
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self.future = None
+
+    @property
+    def done(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelling(self):
+        return self._cancel.is_set() and not self.done
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.submitted
+
+    def cancel(self):
+        self._cancel.set()
+        # A job that has not started yet never will
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED)
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def report(self, fraction=None, text=None):
+        """Progress from inside the job; also a point where cancellation takes effect."""
+        self.check()
+        if fraction is not None:
+            self.progress = max(self.progress, min(float(fraction), 1.0))
+        if text is not None:
+            self.stage = text
+
+    def _enter_stage(self, name):
+        self.check()
+        self.stage = name
+        if name in self.stages:
+            self.report(self.stages.index(name) / len(self.stages))
+
+    def _finish(self, state):
+        self.state = state
+        self.finished = time.time()
+
+    def _run(self, fn, args, kwargs):
+        if self._cancel.is_set():
+            return self._finish(CANCELLED)
+        self.state = RUNNING
+        _local.job = self
+        token = instrument.stage_hook.set(self._enter_stage)
+        try:
+            result = fn(*args, **kwargs)
+        except JobCancelled:
+            self._finish(CANCELLED)
+        except Exception as e:
+            self.error = e
+            self._finish(FAILED)
+        else:
+            self.result = result
+            self.progress = 1.0
+            self._finish(DONE)
+        finally:
+            instrument.stage_hook.reset(token)
+            _local.job = None
+
+
+_local = threading.local()
+
+
+def submit(fn, *args, name, key=None, stages=(), **kwargs):
+    """Run ``fn(*args, **kwargs)`` in the background and return its Job at once."""
+    job = Job(name, key, stages)
+    job.future = _pool.submit(job._run, fn, args, kwargs)
+    return job
+
+
+def current():
+    """The job running on this thread, or None outside a job."""
+    return getattr(_local, "job", None)
@@ -0,0 +1,59 @@
+"""Fingerprints and a size-bounded LRU shared by the engine caches."""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def fingerprint(*parts):
+    # Stable key for a file digest plus the parameters that produced a result
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by the total ``sizeof`` of its values.
+
+    Streamlit serves every session from threads of one process, so a cache
+    at module level is shared by all sessions.
+    """
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            # Evict least recently used values; the newest one always stays
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
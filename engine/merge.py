@@ -0,0 +1,204 @@
+"""Merge partial gradebook exports for one course.
+
+Each file's students are keyed by a normalized identity (email, ID number
+or first and last name). The keys of all files are factorized together in
+one hash pass, and every column is gathered into place with one take, so
+the merge is linear in the number of rows. Score columns that appear in more
+than one file keep pandas' "name.1" labels, which the Resolver then picks
+up as duplicates.
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine.ingest import IDENTITY_COLUMNS
+from engine.instrument import stage
+from engine.memo import LRUCache, fingerprint, frame_nbytes
+
+IDENTITY_KEYS = {
+    "Email address": ["Email address"],
+    "ID number": ["ID number"],
+    "First name / Last name": ["First name", "Last name"],
+}
+
+_SEPARATOR = "\x1f"
+
+
+def _key_part(series):
+    # Text form of one identity column: case and spacing folded, whole floats
+    # written as ints so 1234.0 in one file matches 1234 in another
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        whole = np.isnan(values) | (values == np.floor(values))
+        if whole.all():
+            series = series.astype("Int64")
+    text = series.astype("string").str.strip()
+    # lower() runs in Arrow and matches casefold() on ASCII; casefold() goes through
+    # Python strings, so it only sees the values that need it (e.g. "ß")
+    folded = text.str.lower()
+    other = ~text.str.isascii().fillna(True).to_numpy(dtype=bool)
+    if other.any():
+        folded[other] = text[other].str.casefold()
+    text = folded.str.replace(r"\s+", " ", regex=True)
+    return text.mask(text == "")
+
+
+def student_keys(df, key_columns):
+    """One normalized key per row, as Arrow-backed text; missing where any identity column is blank."""
+    missing = [col for col in key_columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing identity column(s): {', '.join(missing)}")
+    parts = [_key_part(df[col]) for col in key_columns]
+    key = parts[0]
+    for part in parts[1:]:
+        key = key + _SEPARATOR + part
+    return key
+
+
+@dataclass
+class MergeResult:
+    df: pd.DataFrame            # one row per student, identity columns first
+    unmatched: pd.DataFrame     # students missing from at least one file
+    skipped: pd.DataFrame       # rows left out: blank identity or repeated within a file
+    files: list
+
+    @property
+    def matched(self):
+        return len(self.df) - len(self.unmatched)
+
+
+def _nullable(series):
+    # Integer marks stay integers (7, not 7.0) for students missing from this file
+    if pd.api.types.is_integer_dtype(series.dtype) and isinstance(series.dtype, np.dtype):
+        return series.astype(series.dtype.name.replace("uint", "UInt").replace("int", "Int"))
+    return series
+
+
+def _gather(series, source):
+    # Row source[i] of ``series`` for each merged row; -1 leaves the row blank
+    values = pd.api.extensions.take(series.array, source, allow_fill=True)
+    return pd.Series(values, name=series.name, copy=False)
+
+
+def file_labels(names):
+    # Distinct labels for the uploaded files: exports of one course often share a
+    # file name, so repeats become "grades.csv (2)", "grades.csv (3)", ...
+    seen, labels = set(), []
+    for name in names:
+        label, n = name, 1
+        while label in seen:
+            n += 1
+            label = f"{name} ({n})"
+        seen.add(label)
+        labels.append(label)
+    return labels
+
+
+def _label(col, seen):
+    # pandas' own scheme for repeated headers: "Quiz", "Quiz.1", "Quiz.2", ...
+    label, n = col, 0
+    while label in seen:
+        n += 1
+        label = f"{col}.{n}"
+    seen.add(label)
+    return label
+
+
+def _sources(frames, key_columns):
+    """Row of each file for every student, -1 where the student is not in it.
+
+    Every file's keys are factorized together, so the codes number the
+    students in first-seen order. Rows with a blank or repeated identity are
+    left out and listed in ``skipped``.
+    """
+    keys = pd.concat([student_keys(df, key_columns) for df in frames.values()], ignore_index=True)
+    codes = pd.factorize(keys)[0]
+    n_students = codes.max() + 1 if len(codes) else 0
+
+    sources, skipped, offset = {}, [], 0
+    for name, df in frames.items():
+        file_codes = codes[offset:offset + len(df)]
+        offset += len(df)
+        blank = file_codes < 0
+        repeated = pd.Series(file_codes).duplicated().to_numpy() & ~blank
+        for reason, mask in (("Blank identity", blank), ("Repeated within file", repeated)):
+            if mask.any():
+                skipped.append(pd.DataFrame({"File": name, "Row": df.index[mask] + 2, "Reason": reason}))
+        keep = np.flatnonzero(~(blank | repeated))
+        source = np.full(n_students, -1, dtype=np.intp)
+        source[file_codes[keep]] = keep
+        sources[name] = (df, source)
+    return sources, skipped, n_students
+
+
+def merge_frames(frames, key_columns):
+    """Outer-join ``frames`` (a dict of file name -> DataFrame) on the student identity."""
+    key_columns = list(key_columns)
+    if len(frames) < 2:
+        raise ValueError("Upload at least two gradebooks to merge.")
+
+    with stage("keys"):
+        sources, skipped, n_students = _sources(frames, key_columns)
+
+    with stage("join"):
+        rows = np.arange(n_students)
+        present = np.zeros((n_students, len(sources)), dtype=bool)
+        identity = list(dict.fromkeys(IDENTITY_COLUMNS + key_columns))
+        shared = {}     # identity column -> values; the first file with a value wins
+        scores = {}     # every other column, labelled uniquely
+        seen = set(identity)
+
+        for i, (df, source) in enumerate(sources.values()):
+            present[:, i] = source >= 0
+            gaps = not present[:, i].all()
+            in_order = not gaps and len(df) == n_students and (source == rows).all()
+            for col in df.columns:
+                values = df[col]
+                if in_order:
+                    # Rows already line up with the students: the column is shared, not copied
+                    values = values.reset_index(drop=True)
+                else:
+                    values = _gather(_nullable(values) if gaps else values, source)
+                if col not in identity:
+                    scores[_label(col, seen)] = values
+                elif col not in shared:
+                    shared[col] = values
+                else:
+                    blank = shared[col].isna()
+                    if (blank & values.notna()).any():
+                        shared[col] = shared[col].astype(object).where(~blank, values.astype(object))
+
+        # The gathered columns become the frame's columns as they are, without a consolidating copy
+        columns = {col: shared[col] for col in identity if col in shared} | scores
+        merged = pd.DataFrame(columns, index=pd.RangeIndex(n_students), copy=False)
+
+    names = list(sources)
+    incomplete = ~present.all(axis=1)
+    unmatched = merged.loc[incomplete, [col for col in identity if col in shared]]
+    unmatched["Missing from"] = [
+        ", ".join(name for name, has in zip(names, row) if not has) for row in present[incomplete]
+    ]
+    skipped = pd.concat(skipped, ignore_index=True) if skipped else pd.DataFrame(columns=["File", "Row", "Reason"])
+    return MergeResult(df=merged, unmatched=unmatched, skipped=skipped, files=names)
+
+
+# Upper bound on the memory held by memoized merges
+MAX_MERGE_BYTES = int(os.environ.get("MODERATOR_MERGE_CACHE_MB", "256")) * 1024 * 1024
+
+merge_cache = LRUCache(MAX_MERGE_BYTES, sizeof=lambda result: frame_nbytes(result.df))
+
+
+def merge_key(digests, key_columns):
+    return fingerprint(tuple(digests), tuple(key_columns))
+
+
+def merge_cached(frames, digests, key_columns):
+    """merge_frames() memoized on the files' digests and the identity columns."""
+    key = merge_key(digests, key_columns)
+    result = merge_cache.get(key)
+    if result is None:
+        result = merge_frames(frames, key_columns)
+        merge_cache.put(key, result)
+    return result
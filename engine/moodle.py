@@ -0,0 +1,450 @@
+"""Moodle moderation engine.
+
+Whole-column version of the boundary bump, further moderation, grade and
+status steps behind pages/Moodle_moderation.py. Nothing here imports
+Streamlit, so the same code can be driven from scripts.
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from engine import ingest, numeric
+from engine.instrument import stage
+from engine.memo import LRUCache, fingerprint, frame_nbytes
+
+PASS_MARK = 40
+BOUNDARY_SCORES = [39, 44, 49, 59, 69]
+GRADE_EDGES = [40, 45, 50, 60, 70]
+GRADE_LABELS = np.array(["F", "E", "D", "C", "B", "A"], dtype=object)
+STATUSES = ["Pass", "Fail", "Incomplete", "No Score"]
+
+# Working columns added by moderate() that are dropped from the export
+HELPER_COLS = ["RawScore", "ModeratedTotalScore", "ModeratedExamScore", "BoundaryAdjusted", "Status", "Grade"]
+PREVIEW_COLS = ["First name", "Last name", "ModeratedExamScore", "RawScore", "ModeratedTotalScore", "Grade", "Status"]
+MODERATED_LIST_COLS = [
+    "First name", "Last name", "ExamScoreBefore",
+    "ModeratedExamScore", "ModeratedTotalScore",
+    "Grade", "Status"
+]
+LEDGER_COLS = ["Row", "Field", "Old", "New", "Reason"]
+# stage() names moderate() passes through, in order (progress for background jobs)
+STAGES = ["coerce", "boundary", "further", "status", "ledger"]
+
+
+# --- Column operations ---
+def to_numeric_matrix(df, columns):
+    # Float matrix of the selected columns; "-", blanks and text become NaN.
+    # Coercion is cached per frame, so reruns with other columns reuse it.
+    return numeric.view(df).matrix(columns)
+
+
+def raw_totals(matrix):
+    # Missing scores count as 0 towards the total
+    return np.nansum(matrix, axis=1)
+
+
+def round_boundary(scores):
+    scores = np.asarray(scores, dtype="float64")
+    return np.where(np.isin(scores, BOUNDARY_SCORES), scores + 1, scores)
+
+
+def assign_grade(scores):
+    return GRADE_LABELS[np.searchsorted(GRADE_EDGES, scores, side="right")]
+
+
+def grades(scores, attempted_all):
+    # Grades are only given to students who attempted ALL selected assessments
+    return np.where(attempted_all, assign_grade(scores), np.nan)
+
+
+_STATUS_LABELS = np.array(["No Score", "Incomplete", "Pass", "Fail"], dtype=object)
+
+
+def classify_status(attempted, totals):
+    attempted_count = attempted.sum(axis=1)
+    codes = np.select(
+        [attempted_count == 0, attempted_count < attempted.shape[1], totals >= PASS_MARK],
+        [0, 1, 2],
+        default=3
+    )
+    return _STATUS_LABELS[codes]
+
+
+# --- Pipeline ---
+@dataclass
+class ModerationResult:
+    df: pd.DataFrame            # input frame plus RawScore, ModeratedTotalScore, Grade, ModeratedExamScore, Status
+    numeric: np.ndarray         # selected columns as floats, after further moderation
+    columns: list
+    update_field: str
+    threshold: int
+    further_mask: np.ndarray    # students lifted to the pass mark by further moderation
+    ledger: pd.DataFrame        # one row per changed cell, see change_ledger()
+
+    @property
+    def attempted(self):
+        return ~np.isnan(self.numeric)
+
+    @property
+    def attempted_all(self):
+        return self.attempted.all(axis=1)
+
+    @property
+    def further_count(self):
+        return int(self.further_mask.sum())
+
+
+@dataclass
+class BoundaryStage:
+    # Everything that depends only on the selected columns, not on update_field or threshold
+    numeric: np.ndarray         # selected columns as floats; shared, never modified in place
+    raw: np.ndarray
+    total: np.ndarray           # raw totals after the boundary bump
+    grade: np.ndarray
+    status: np.ndarray
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.numeric, self.raw, self.total, self.grade, self.status))
+
+
+def boundary_stage(df, columns):
+    with stage("coerce"):
+        numeric = to_numeric_matrix(df, columns)
+    attempted = ~np.isnan(numeric)
+
+    # ---------- Initial moderation (boundary) ----------
+    with stage("boundary"):
+        raw = raw_totals(numeric)
+        total = round_boundary(raw)
+        grade = grades(total, attempted.all(axis=1))
+        status = classify_status(attempted, total)
+    return BoundaryStage(numeric=numeric, raw=raw, total=total, grade=grade, status=status)
+
+
+def check_params(columns, update_field):
+    if not columns:
+        raise ValueError("Select at least one column to include in the score calculation.")
+    if update_field not in columns:
+        raise ValueError(f"The update field '{update_field}' must be one of the selected columns.")
+
+
+def moderate(df, columns, update_field, threshold=0, boundary=None):
+    """Full Moodle moderation; ``boundary`` reuses an earlier boundary_stage() for these columns."""
+    columns = list(columns)
+    check_params(columns, update_field)
+    if boundary is None:
+        boundary = boundary_stage(df, columns)
+
+    numeric = boundary.numeric
+    attempted = ~np.isnan(numeric)
+    attempted_all = attempted.all(axis=1)
+    j = columns.index(update_field)
+    raw, total, grade = boundary.raw, boundary.total, boundary.grade
+
+    exam_before = numeric[:, j]
+    grade_before = grade
+    status_before = status = boundary.status
+
+    # ---------- Further moderation (optional) ----------
+    # Only failed students with a recorded update_field value are lifted, so
+    # previously-missing cells never turn into recorded attempts
+    further = np.zeros(len(df), dtype=bool)
+    with stage("further"):
+        if threshold > 0:
+            further = (grade == "F") & (total >= threshold) & (total < PASS_MARK) & attempted[:, j]
+            if further.any():
+                numeric = numeric.copy()
+                numeric[further, j] += PASS_MARK - total[further]
+                raw = raw_totals(numeric)
+                total = round_boundary(raw)
+                grade = grades(total, attempted_all)
+                status = classify_status(attempted, total)
+
+    # ---------- Final moderated value for the update_field ----------
+    exam = np.where(attempted[:, j], numeric[:, j] + (total - raw), np.nan)
+
+    with stage("status"):
+        # Shares the uploaded columns with ``df``; only the added ones are new
+        out = df.copy(deep=False)
+        out["RawScore"] = raw
+        out["ModeratedTotalScore"] = total
+        out["Grade"] = grade
+        out["ModeratedExamScore"] = exam
+        # Moderated value where applicable; original blanks/markers are preserved
+        original = out[update_field]
+        if pd.api.types.is_numeric_dtype(original.dtype):
+            out[update_field] = out["ModeratedExamScore"].combine_first(original)
+        else:
+            # Text with "-" markers: only the kept cells are read, not the whole column as objects
+            updated = exam.astype(object)
+            kept = np.flatnonzero(np.isnan(exam))
+            updated[kept] = original.iloc[kept].to_numpy(dtype=object)
+            out[update_field] = pd.Series(updated, index=out.index, dtype=object)
+        out["Status"] = status
+
+    with stage("ledger"):
+        ledger = change_ledger(
+            further,
+            (update_field, exam_before, exam),
+            ("Grade", grade_before, grade),
+            ("Status", status_before, status),
+        )
+
+    return ModerationResult(
+        df=out,
+        numeric=numeric,
+        columns=columns,
+        update_field=update_field,
+        threshold=threshold,
+        further_mask=further,
+        ledger=ledger,
+    )
+
+
+# --- Change ledger ---
+def _changed(old, new):
+    # Cells whose value differs; NaN to NaN is not a change
+    old_missing, new_missing = pd.isna(old), pd.isna(new)
+    with np.errstate(invalid="ignore"):
+        return (old_missing != new_missing) | (~old_missing & ~new_missing & (old != new))
+
+
+def change_ledger(further, *fields):
+    """Every cell moderation changed, as Row (position), Field, Old, New and Reason.
+
+    ``fields`` are (name, before, after) arrays, where "before" is the value
+    after the boundary step only for Grade and Status. A change in a row lifted
+    by further moderation is a "threshold" change, any other a "boundary" one.
+    Only changed rows are kept, so the ledger grows with the number of
+    adjustments rather than with the cohort.
+    """
+    parts = []
+    for name, old, new in fields:
+        rows = np.flatnonzero(_changed(old, new))
+        parts.append(pd.DataFrame({
+            "Row": rows.astype("int32"),
+            "Field": name,
+            "Old": pd.array(old[rows], dtype=object),
+            "New": pd.array(new[rows], dtype=object),
+            "Reason": np.where(further[rows], "threshold", "boundary"),
+        }))
+    ledger = pd.concat(parts, ignore_index=True)
+    ledger["Field"] = ledger["Field"].astype("category")
+    ledger["Reason"] = ledger["Reason"].astype("category")
+    return ledger
+
+
+def ledger_entries(result, field, reason=None):
+    ledger = result.ledger
+    mask = ledger["Field"] == field
+    if reason is not None:
+        mask &= ledger["Reason"] == reason
+    return ledger[mask]
+
+
+
+# Upper bound on the memory held by memoized moderation results
+MAX_RESULT_BYTES = int(os.environ.get("MODERATOR_RESULT_CACHE_MB", "512")) * 1024 * 1024
+
+
+def _result_nbytes(result):
+    # The uploaded columns are shared with the ingest cache; only what moderate() adds or replaces is new
+    added = ["RawScore", "ModeratedTotalScore", "Grade", "ModeratedExamScore", "Status", result.update_field]
+    columns = int(result.df[added].memory_usage(index=False, deep=True).sum())
+    return columns + result.numeric.nbytes + result.further_mask.nbytes + frame_nbytes(result.ledger)
+
+
+result_cache = LRUCache(MAX_RESULT_BYTES, sizeof=_result_nbytes)
+# Boundary stages per (file, columns): changing only update_field or threshold starts from here
+boundary_cache = LRUCache(MAX_RESULT_BYTES // 4, sizeof=lambda boundary: boundary.nbytes)
+
+
+def result_key(digest, columns, update_field, threshold):
+    return fingerprint(digest, tuple(columns), update_field, int(threshold))
+
+
+def moderate_cached(df, digest, columns, update_field, threshold=0):
+    """moderate() memoized on the file digest and moderation parameters.
+
+    Each stage is cached on its own inputs: coercion per column (engine.numeric),
+    totals, boundary and grades per set of columns, and the final result per
+    update_field and threshold. A parameter change only redoes what follows it.
+    """
+    key = result_key(digest, columns, update_field, threshold)
+    result = result_cache.get(key)
+    if result is None:
+        check_params(columns, update_field)
+        boundary_key = fingerprint(digest, tuple(columns))
+        boundary = boundary_cache.get(boundary_key)
+        if boundary is None:
+            boundary = boundary_stage(df, columns)
+            boundary_cache.put(boundary_key, boundary)
+        result = moderate(df, columns, update_field, threshold, boundary)
+        result_cache.put(key, result)
+    return result
+
+
+# --- Threshold sweep ---
+def _from_top(counts):
+    # counts[t] -> number of entries in bins t and above
+    return counts[::-1].cumsum()[::-1]
+
+
+def threshold_sweep(base):
+    """Outcome of every further-moderation threshold from 0 to 39.
+
+    ``base`` is the threshold-0 result. A threshold ``t`` lifts the failed
+    students whose total lies in [t, 40), and each student's lifted total
+    does not depend on ``t``. So the candidates are lifted once, binned by
+    ModeratedTotalScore, and the bins summed from the top give every threshold.
+    """
+    if base.threshold != 0:
+        raise ValueError("The sweep starts from the result without further moderation (threshold 0).")
+    j = base.columns.index(base.update_field)
+    total = base.df["ModeratedTotalScore"].to_numpy()
+    grade = base.df["Grade"].to_numpy()
+
+    # Everyone a threshold of 1 would lift; higher thresholds lift a subset
+    candidates = (grade == "F") & (total >= 1) & (total < PASS_MARK) & base.attempted[:, j]
+    lifted = base.numeric[candidates]
+    lifted[:, j] += PASS_MARK - total[candidates]
+    lifted_total = round_boundary(raw_totals(lifted))
+    lifted_grade = assign_grade(lifted_total)
+
+    bins = np.floor(total[candidates]).astype(int)
+    thresholds = np.arange(PASS_MARK)
+
+    def swept(mask):
+        counts = _from_top(np.bincount(bins[mask], minlength=PASS_MARK))
+        counts[0] = 0  # threshold 0 means no further moderation
+        return counts
+
+    moderated = swept(slice(None))
+    passed = int((base.df["Status"] == "Pass").sum()) + swept(lifted_total >= PASS_MARK)
+    sweep = pd.DataFrame({
+        "Threshold": thresholds,
+        "Moderated to 40": moderated,
+        "Pass": passed,
+        "Pass rate": passed / len(total) if len(total) else np.zeros(PASS_MARK),
+    })
+    grade_counts = pd.Series(grade).dropna().astype(str).value_counts()
+    for label in GRADE_LABELS[::-1]:
+        counts = int(grade_counts.get(label, 0)) + swept(lifted_grade == label)
+        if label == "F":
+            counts = counts - moderated
+        sweep[f"Grade {label}"] = counts
+    return sweep.set_index("Threshold")
+
+
+def threshold_sweep_cached(df, digest, columns, update_field):
+    return threshold_sweep(moderate_cached(df, digest, columns, update_field, 0))
+
+
+# --- Reporting ---
+def build_summary(result):
+    df = result.df
+    numeric = result.numeric
+    attempted = result.attempted
+    update_field = result.update_field
+    j = result.columns.index(update_field)
+
+    total_students = len(df)
+    attempted_all = int(result.attempted_all.sum())
+    others = np.delete(attempted, j, axis=1)
+    update_only = int((attempted[:, j] & ~others.all(axis=1)).sum())
+    boundary_count = int(np.isin(df["RawScore"].to_numpy(), BOUNDARY_SCORES).sum())
+
+    summary_rows = [
+        ["Total enrolled", total_students, "100%"],
+        ["Attempted all selected assessments", attempted_all, f"{attempted_all/total_students:.1%}"],
+        [f"Attempted {update_field} only (missed others)", update_only, f"{update_only/total_students:.1%}"],
+        ["Boundary adjustments (+1)", boundary_count, f"{boundary_count/total_students:.1%}"],
+    ]
+    if result.threshold > 0:
+        further_count = result.further_count
+        summary_rows.append(["Further moderated to 40", further_count, f"{further_count/total_students:.1%}"])
+
+    # Per-assessment attempt counts
+    for col, cnt in zip(result.columns, attempted.sum(axis=0)):
+        summary_rows.append([f"Attempted {col}", int(cnt), f"{cnt/total_students:.1%}"])
+
+    # Status distribution
+    status_counts = df["Status"].value_counts()
+    for st_label in STATUSES:
+        cnt = int(status_counts.get(st_label, 0))
+        summary_rows.append([st_label, cnt, f"{cnt/total_students:.1%}"])
+
+    # Grade distribution (exclude NaN)
+    for grade, cnt in df["Grade"].dropna().value_counts().sort_index().items():
+        summary_rows.append([f"Grade {grade}", int(cnt), f"{cnt/total_students:.1%}"])
+
+    return pd.DataFrame(summary_rows, columns=["Metric", "Count", "Percentage"])
+
+
+def preview_frame(result):
+    show_cols = PREVIEW_COLS[:2] + [result.update_field] + PREVIEW_COLS[2:]
+    return result.df[[c for c in show_cols if c in result.df.columns]]
+
+
+def moderated_list(result):
+    # Students lifted to 40, with their update_field value before moderation
+    changes = ledger_entries(result, result.update_field, "threshold")
+    moderated = result.df.iloc[changes["Row"].to_numpy()]
+    moderated["ExamScoreBefore"] = changes["Old"].to_numpy(dtype="float64")
+    moderated = moderated[[c for c in MODERATED_LIST_COLS if c in moderated.columns]]
+    return moderated[moderated["Status"] != "Incomplete"]
+
+
+def _before_counts(result, field, after):
+    # Counts before further moderation: the ledger's old values replace its new ones
+    changes = ledger_entries(result, field, "threshold")
+    old = changes["Old"].dropna().astype(str).value_counts()
+    new = changes["New"].dropna().astype(str).value_counts()
+    labels = after.index.union(old.index)
+    before = after.reindex(labels, fill_value=0) - new.reindex(labels, fill_value=0) + old.reindex(labels, fill_value=0)
+    return before[before > 0]
+
+
+def status_comparison(result):
+    after = result.df["Status"].value_counts()
+    before = _before_counts(result, "Status", after).reindex(STATUSES, fill_value=0)
+    return before, after.reindex(STATUSES, fill_value=0)
+
+
+def grade_comparison(result):
+    after = result.df["Grade"].dropna().astype(str).value_counts()
+    before = _before_counts(result, "Grade", after)
+    grades_all = sorted(set(before.index) | set(after.index))
+    return grades_all, before.reindex(grades_all, fill_value=0), after.reindex(grades_all, fill_value=0)
+
+
+def audit_frame(result):
+    """The change ledger with each student's identity, for download.
+
+    Row is the student's line in the uploaded file, counting the header as line 1.
+    """
+    ledger = result.ledger
+    rows = ledger["Row"].to_numpy()
+    identity = [c for c in ingest.IDENTITY_COLUMNS if c in result.df.columns]
+    audit = result.df[identity].iloc[rows].reset_index(drop=True)
+    audit.insert(0, "Row", rows + 2)
+    for col in LEDGER_COLS[1:]:
+        audit[col] = ledger[col].to_numpy()
+    audit["Threshold"] = result.threshold
+    return audit
+
+
+def export_frame(result, full=None):
+    # Helper columns dropped; only students with a valid score in every selected column are kept.
+    # A result computed on projected columns is written back over the ``full`` frame.
+    to_drop = [c for c in HELPER_COLS if c in result.df.columns]
+    out = result.df.drop(columns=to_drop)
+    attempted_all = result.attempted_all
+    if not attempted_all.all():
+        out = out[attempted_all]
+    if full is not None:
+        out = ingest.rejoin(full, out)
+    return out
@@ -0,0 +1,179 @@
+"""Cached numeric views of score columns.
+
+Every stage used to run ``pd.to_numeric(errors="coerce")`` on the same
+columns. A view coerces each column of a frame once, the first time any
+stage asks for it, and keeps the float values, the cells that failed
+coercion, and what ``pd.to_numeric`` would have made of each cell's type.
+
+Views are cached per frame object. Frames from the ingest cache are
+shared read-only, so a view stays valid for as long as its frame lives.
+"""
+import re
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Per-cell kind, used to reproduce the dtype pd.to_numeric picks for a set of rows
+OTHER, INT, INT_TEXT, WHOLE_FLOAT = 0, 1, 2, 3
+
+_INT_TEXT = re.compile(r"^\s*[+-]?[0-9]+\s*$")
+
+
+def _value_kinds(values, coerced):
+    # Kind of each distinct object value; strings count as ints only in integer notation
+    kinds = np.zeros(len(values), dtype="int8")
+    for i, (value, number) in enumerate(zip(values, coerced)):
+        if isinstance(value, str):
+            if _INT_TEXT.match(value) and not np.isnan(number) and abs(number) < 2**63:
+                kinds[i] = INT_TEXT
+        elif isinstance(value, (bool, np.bool_)):
+            continue
+        elif isinstance(value, (int, np.integer)):
+            kinds[i] = INT
+        elif isinstance(value, (float, np.floating)) and float(value).is_integer():
+            kinds[i] = WHOLE_FLOAT
+    return kinds
+
+
+def _take(values, kinds, codes):
+    # Expand per-distinct-value results to cells; code -1 is a missing cell and
+    # picks the NaN/OTHER slot appended at the end, so no masked copies are made
+    out = np.append(np.asarray(values, dtype="float64"), np.nan)[codes]
+    kind = np.append(kinds, np.int8(OTHER))[codes]
+    return out, kind
+
+
+def _coerce_object(values):
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    coerced = pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    kinds = _value_kinds(uniques, coerced)
+    out, kind = _take(coerced, kinds, codes)
+    if (kinds == WHOLE_FLOAT).any():
+        # factorize() folds 12 and 12.0 together; tell them apart cell by cell
+        kind = _value_kinds(values, out)
+    return out, kind
+
+
+def _coerce(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        if pd.api.types.is_numeric_dtype(categories.dtype):
+            cat_values = categories.to_numpy(dtype="float64")
+            cat_kinds = np.full(len(categories), INT if pd.api.types.is_integer_dtype(categories.dtype) else OTHER, dtype="int8")
+        else:
+            cat_values, cat_kinds = _coerce_object(categories.to_numpy(dtype=object))
+            # categories are distinct, so these line up with the category codes
+        values, kinds = _take(cat_values, cat_kinds, series.cat.codes.to_numpy())
+    elif pd.api.types.is_bool_dtype(dtype):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        kinds = np.zeros(len(series), dtype="int8")
+    elif pd.api.types.is_numeric_dtype(dtype):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        kinds = np.full(len(series), INT if pd.api.types.is_integer_dtype(dtype) else OTHER, dtype="int8")
+        kinds[np.isnan(values)] = OTHER
+    else:
+        values, kinds = _coerce_object(series.to_numpy(dtype=object))
+    failed = series.notna().to_numpy() & np.isnan(values)
+    return values, failed, kinds
+
+
+class NumericView:
+    """Float values, failed cells and cell kinds of a frame's columns, coerced once."""
+
+    def __init__(self, df):
+        self._frame = weakref.ref(df)
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def _column(self, col):
+        with self._lock:
+            cached = self._columns.get(col)
+        if cached is None:
+            cached = _coerce(self._frame()[col])
+            with self._lock:
+                self._columns[col] = cached
+        return cached
+
+    def values(self, col):
+        return self._column(col)[0]
+
+    def series(self, col):
+        df = self._frame()
+        return pd.Series(self.values(col), index=df.index, name=col)
+
+    def matrix(self, columns, rows=None):
+        # Float matrix of ``columns``; ``rows`` selects row positions
+        n = len(self._frame()) if rows is None else len(rows)
+        matrix = np.empty((n, len(columns)), dtype="float64")
+        for j, col in enumerate(columns):
+            values = self.values(col)
+            matrix[:, j] = values if rows is None else values[rows]
+        return matrix
+
+    def failed(self, columns):
+        """Cells that hold something but did not coerce, as a boolean frame."""
+        df = self._frame()
+        return pd.DataFrame({col: self._column(col)[1] for col in columns}, index=df.index)
+
+    def integer_columns(self, columns, rows):
+        # Whether pd.to_numeric(df.iloc[rows][col]) would come back as an integer dtype:
+        # all cells ints, or plain numbers led by an int with any floats whole
+        flags = []
+        for col in columns:
+            kinds = self._column(col)[2][rows]
+            if len(kinds) == 0:
+                flags.append(False)
+                continue
+            seen = np.bincount(kinds, minlength=4).astype(bool)
+            strict = not (seen[OTHER] or seen[WHOLE_FLOAT])
+            loose = kinds[0] == INT and not (seen[OTHER] or seen[INT_TEXT])
+            flags.append(bool(strict or loose))
+        return np.array(flags, dtype=bool)
+
+
+_views = {}
+_views_lock = threading.Lock()
+
+
+def view(df):
+    """The NumericView of ``df``, created on first use and dropped with the frame."""
+    key = id(df)
+    with _views_lock:
+        current = _views.get(key)
+        if current is not None and current._frame() is df:
+            return current
+        current = NumericView(df)
+        _views[key] = current
+    weakref.finalize(df, _forget, key, current)
+    return current
+
+
+def _forget(key, dead):
+    with _views_lock:
+        if _views.get(key) is dead:
+            del _views[key]
+
+
+def failed_cells(df, columns, placeholders=()):
+    """Row, column and raw value of every cell in ``columns`` that failed coercion.
+
+    Cells holding one of ``placeholders`` (Moodle's "-") count as blank, not failed.
+    """
+    failed = view(df).failed(columns)
+    if placeholders:
+        failed = failed & ~df[list(columns)].isin(placeholders).to_numpy()
+    rows, cols = np.nonzero(failed.to_numpy())
+    names = failed.columns[cols]
+    return pd.DataFrame({
+        "Row": df.index[rows],
+        "Column": names,
+        "Value": [df[name].iloc[r] for name, r in zip(names, rows)],
+    })
+
+
+def failed_counts(df, columns):
+    return view(df).failed(columns).sum()
@@ -0,0 +1,246 @@
+"""Moodle gradebook duplicate-column resolver.
+
+Every duplicate column is coerced once into a single float matrix and the
+groups are reduced together, one NaN-aware reduction per strategy (highest
+score by default): a student with no score in any column of a group gets
+NaN, otherwise the strategy's pick of their scores.
+"""
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from engine import ingest, numeric
+from engine.instrument import stage
+
+# stage() names resolve() passes through, in order (progress for background jobs)
+STAGES = ["coerce", "reduce"]
+
+_SUFFIX = re.compile(r"\.\d+$")
+
+
+def normalize_col(col):
+    col = col.strip()
+    col = _SUFFIX.sub("", col)  # remove .1, .2, .3
+    return col
+
+
+# Everything Moodle (or pandas) appends to a repeated activity name, in one match:
+# the "(Real)" display-type suffix and the ".1", ".2" pandas adds to repeated headers
+_DUPLICATE = re.compile(r"^\s*(?P<base>.*?)(?:\s*\(Real\))?(?:\.\d+)?\s*$", re.DOTALL)
+_SPACES = re.compile(r"\s+")
+
+
+def duplicate_key(col):
+    # Columns with the same key hold the same activity; runs of whitespace are folded too
+    return _SPACES.sub(" ", _DUPLICATE.match(str(col)).group("base"))
+
+
+def detect_duplicates(columns):
+    """Groups of columns that repeat one activity, keyed by the group's display name.
+
+    "Quiz 1", "Quiz 1.1", "Quiz 1 (Real)" and "Quiz  1 (Real).2" all land in one group.
+    """
+    groups = {}
+    for col in columns:
+        groups.setdefault(duplicate_key(col), []).append(col)
+    # Named after the first column, as normalize_col() has always done
+    return {normalize_col(str(cols[0])): cols for cols in groups.values() if len(cols) > 1}
+
+
+def group_table(duplicates, search=""):
+    """One row per duplicate group, optionally filtered by a case-insensitive search."""
+    table = pd.DataFrame({
+        "Group": list(duplicates),
+        "Resolved column": [resolved_name(base) for base in duplicates],
+        "Columns": [len(cols) for cols in duplicates.values()],
+        "Merged columns": [", ".join(map(str, cols)) for cols in duplicates.values()],
+    })
+    if search:
+        text = table["Group"] + "\n" + table["Merged columns"]
+        table = table[text.str.contains(search, case=False, regex=False)]
+    return table
+
+
+def resolved_name(base):
+    return f"{base} (Resolved)"
+
+
+def default_groups(duplicates, strategy=None):
+    # column_groups for detect_duplicates() output, every group named "<base> (Resolved)"
+    groups = {base: {"selected": cols, "resolved_name": resolved_name(base)} for base, cols in duplicates.items()}
+    if strategy is not None:
+        for group in groups.values():
+            group["strategy"] = strategy
+    return groups
+
+
+def to_matrix(df, columns):
+    return numeric.view(df).matrix(columns)
+
+
+# --- Resolution strategies ---
+# Each strategy reduces groups laid side by side in ``block`` (groups start at
+# ``starts``) to one column per group. A student with no score in any column
+# of a group always resolves to NaN.
+def _counts(block, starts):
+    return np.add.reduceat(~np.isnan(block), starts, axis=1)
+
+
+def _resolve_max(block, starts):
+    return np.fmax.reduceat(block, starts, axis=1)
+
+
+def _resolve_sum(block, starts):
+    sums = np.add.reduceat(np.nan_to_num(block, nan=0.0), starts, axis=1)
+    return np.where(_counts(block, starts) > 0, sums, np.nan)
+
+
+def _resolve_mean(block, starts):
+    counts = _counts(block, starts)
+    sums = np.add.reduceat(np.nan_to_num(block, nan=0.0), starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _pick(block, starts, first):
+    # Position of the first (or last) filled column of each group, then one gather
+    positions = np.arange(block.shape[1], dtype="float64")
+    filled = ~np.isnan(block)
+    if first:
+        picked = np.fmin.reduceat(np.where(filled, positions, np.nan), starts, axis=1)
+    else:
+        picked = np.fmax.reduceat(np.where(filled, positions, np.nan), starts, axis=1)
+    empty = np.isnan(picked)
+    rows = np.arange(block.shape[0])[:, None]
+    values = block[rows, np.where(empty, 0, picked).astype(np.intp)]
+    values[empty] = np.nan
+    return values
+
+
+def _resolve_first(block, starts):
+    return _pick(block, starts, first=True)
+
+
+def _resolve_last(block, starts):
+    return _pick(block, starts, first=False)
+
+
+STRATEGIES = {
+    "max": _resolve_max,
+    "mean": _resolve_mean,
+    "first": _resolve_first,
+    "last": _resolve_last,
+    "sum": _resolve_sum,
+}
+STRATEGY_LABELS = {
+    "max": "Highest score",
+    "mean": "Average of filled scores",
+    "first": "First non-empty",
+    "last": "Last non-empty (latest attempt)",
+    "sum": "Sum of filled scores",
+}
+DEFAULT_STRATEGY = "max"
+
+
+def register_strategy(name, label, reduce):
+    """Add a strategy; ``reduce(block, starts)`` follows the contract above."""
+    STRATEGIES[name] = reduce
+    STRATEGY_LABELS[name] = label
+
+
+def resolve_matrix(df, column_groups):
+    """Resolved values for every group, one column per group, in group order.
+
+    Each group may name a ``"strategy"`` from STRATEGIES; the default is the
+    highest score.
+    """
+    groups = list(column_groups.values())
+    if not groups:
+        return np.empty((len(df), 0))
+    strategies = [group.get("strategy", DEFAULT_STRATEGY) for group in groups]
+    unknown = sorted(set(strategies) - set(STRATEGIES))
+    if unknown:
+        raise ValueError(f"Unknown resolution strategy: {', '.join(unknown)}")
+
+    # Each distinct column is coerced once, by the frame's numeric view
+    with stage("coerce"):
+        for col in dict.fromkeys(col for group in groups for col in group["selected"]):
+            numeric.view(df).values(col)
+
+    # Groups sharing a strategy are laid out side by side and reduced in one call;
+    # the block is filled straight from the view, with no intermediate matrix
+    resolved = np.empty((len(df), len(groups)))
+    with stage("reduce"):
+        for name in dict.fromkeys(strategies):
+            members = [i for i, strategy in enumerate(strategies) if strategy == name]
+            block = to_matrix(df, [col for i in members for col in groups[i]["selected"]])
+            sizes = [len(groups[i]["selected"]) for i in members]
+            starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            resolved[:, members] = STRATEGIES[name](block, starts)
+            del block
+    return resolved
+
+
+def resolve(df, column_groups):
+    """Copy of ``df`` with a resolved column appended for each group."""
+    resolved = resolve_matrix(df, column_groups)
+    resolved_df = df.copy(deep=False)
+    for j, group in enumerate(column_groups.values()):
+        resolved_df[group["resolved_name"]] = resolved[:, j]
+    return resolved_df
+
+
+def final_frame(resolved_df, column_groups):
+    # Download version: the duplicate source columns are dropped
+    drop_cols = [col for group in column_groups.values() for col in group["selected"]]
+    return resolved_df.drop(columns=drop_cols)
+
+
+# --- Streaming ---
+# Rows per chunk when streaming; peak memory is a small multiple of one chunk
+STREAM_CHUNK_ROWS = 50_000
+# Rows of the resolved file kept for display while streaming
+STREAM_PREVIEW_ROWS = 20
+
+
+@dataclass
+class StreamSummary:
+    rows: int = 0
+    column_groups: dict = field(default_factory=dict)
+    preview: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+
+def _source_size(source):
+    if not hasattr(source, "seek"):
+        return None
+    position = source.tell()
+    size = source.seek(0, 2)
+    source.seek(position)
+    return size
+
+
+def stream_resolve(source, output, column_groups=None, chunksize=STREAM_CHUNK_ROWS, progress=None):
+    """Resolve a Moodle CSV chunk by chunk, appending each final chunk to ``output``.
+
+    Groups are detected from the header unless ``column_groups`` is given.
+    Cells are read as text, so columns that are not resolved are written back
+    exactly as they appeared in the source file. ``progress(rows, fraction)``
+    is called after every chunk; ``fraction`` is None when the source size is
+    unknown (e.g. a path).
+    """
+    if column_groups is None:
+        column_groups = default_groups(detect_duplicates(ingest.read_header(source)))
+    size = _source_size(source)
+    summary = StreamSummary(column_groups=column_groups)
+    for i, chunk in enumerate(pd.read_csv(source, dtype=str, chunksize=chunksize)):
+        final = final_frame(resolve(chunk, column_groups), column_groups)
+        final.to_csv(output, index=False, header=(i == 0))
+
+        summary.rows += len(chunk)
+        if i == 0:
+            summary.preview = final.head(STREAM_PREVIEW_ROWS)
+        if progress is not None:
+            progress(summary.rows, min(source.tell() / size, 1.0) if size else None)
+    return summary
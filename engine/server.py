@@ -0,0 +1,273 @@
+"""Local HTTP moderation API.
+
+Serves the same engine code as the Streamlit pages and the CLI, so registry
+scripts can moderate exports without the browser UI::
+
+    python -m engine.server --port 8765 --jobs 4
+
+    curl -X POST "http://127.0.0.1:8765/moodle?columns=Quiz,Assignment,Exam&update_field=Exam&threshold=35" \\
+         -H "Content-Type: text/csv" --data-binary @gradebook.csv
+    curl -X POST "http://127.0.0.1:8765/canvas?section=Cohort%20A&columns=CA1,CA2,Exam&adjust_column=Exam&format=xlsx" \\
+         -H "Content-Type: text/csv" --data-binary @canvas.csv -o moderated.xlsx
+    curl -X POST "http://127.0.0.1:8765/resolve?strategy=max&format=csv" \\
+         -H "Content-Type: application/vnd.apache.arrow.stream" --data-binary @gradebook.arrows -o resolved.csv
+
+The request body is the export itself: CSV, XLSX or Arrow (IPC file or
+stream), chosen by Content-Type. Options go in the query string. The
+response is a JSON summary by default; ``format=csv`` or ``format=xlsx``
+returns the moderated file instead, with the summary in the
+``X-Moderation-Summary`` header.
+
+Moderation runs on a pool of worker processes. At most ``jobs + queue``
+requests are admitted at once; the rest get 503 straight away. Bodies over
+the size limit get 413 and are never held in memory (clients that send
+"Expect: 100-continue" are refused before uploading). So a large upload
+can take a worker, but it cannot hold up requests beyond that.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from engine import export, ingest, resolver
+from engine.cli import moderate_canvas_file, moderate_moodle_file, resolve_file
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = int(os.environ.get("MODERATOR_API_MAX_MB", "100")) * 1024 * 1024
+# Requests waiting for a worker, on top of those being processed
+DEFAULT_QUEUE = 8
+# Seconds a client may take to send its request before the connection is dropped
+SOCKET_TIMEOUT = 60
+
+# Content-Type -> a file name ingest.read_bytes() understands
+INPUT_TYPES = {
+    "text/csv": "upload.csv",
+    "application/csv": "upload.csv",
+    export.XLSX_MIME: "upload.xlsx",
+    "application/vnd.apache.arrow.file": "upload.arrow",
+    "application/vnd.apache.arrow.stream": "upload.arrows",
+}
+
+
+def _ints(value, default=None):
+    return int(value) if value not in (None, "") else default
+
+
+def _list(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+
+def _moodle_options(query):
+    return {
+        "columns": _list(query.get("columns")),
+        "update_field": query.get("update_field"),
+        "threshold": _ints(query.get("threshold"), 0),
+    }
+
+
+def _canvas_options(query):
+    section = query.get("section")
+    if not section:
+        raise ValueError("Give a section, or section=all to moderate every section.")
+    return {
+        "section": section,
+        "all_sections": section.lower() == "all",
+        "columns": _list(query.get("columns")),
+        "adjust_column": query.get("adjust_column"),
+        "threshold": _ints(query.get("threshold"), 40),
+    }
+
+
+def _resolve_options(query):
+    strategy = query.get("strategy") or resolver.DEFAULT_STRATEGY
+    if strategy not in resolver.STRATEGIES:
+        raise ValueError(f"Unknown resolution strategy: {strategy}")
+    return {"strategy": strategy}
+
+
+# Route -> (option parser, moderation function)
+ROUTES = {
+    "/moodle": (_moodle_options, moderate_moodle_file),
+    "/canvas": (_canvas_options, moderate_canvas_file),
+    "/resolve": (_resolve_options, resolve_file),
+}
+
+
+def _records(df):
+    # JSON-safe rows: numpy scalars become plain numbers, NaN becomes null
+    return json.loads(df.to_json(orient="records"))
+
+
+def run_request(route, data, name, options, fmt):
+    """Worker-process side: parse, moderate and serialize one request.
+
+    Returns (status, content type, body, summary record).
+    """
+    try:
+        df = ingest.read_bytes(data, name)
+        frame, summary, record, _ = ROUTES[route][1](df, options)
+    except (ValueError, KeyError, TypeError) as e:
+        # Bad options or a file without the named columns
+        return HTTPStatus.BAD_REQUEST, None, None, {"error": f"{type(e).__name__}: {e}"}
+
+    if fmt == "json":
+        body = {**record, "summary": _records(summary.reset_index(drop=True))}
+        return HTTPStatus.OK, "application/json", json.dumps(body).encode("utf-8"), record
+    if fmt == "xlsx":
+        return HTTPStatus.OK, export.XLSX_MIME, export.to_xlsx_bytes(frame, "Moderated Results"), record
+    return HTTPStatus.OK, export.CSV_MIME, export.to_csv_bytes(frame), record
+
+
+class ModerationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, jobs=None, queue=DEFAULT_QUEUE, max_bytes=MAX_REQUEST_BYTES):
+        super().__init__(address, ModerationHandler)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        self.max_bytes = max_bytes
+        # Admission control: one slot per worker plus the queue
+        self.slots = threading.BoundedSemaphore(self.jobs + queue)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ModerationHandler(BaseHTTPRequestHandler):
+    server_version = "ModeratorAPI/1.0"
+    # HTTP/1.1 so that "Expect: 100-continue" is honoured; every response closes the connection
+    protocol_version = "HTTP/1.1"
+    timeout = SOCKET_TIMEOUT
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Connection", "close")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, payload, headers=None):
+        self._send(status, "application/json", json.dumps(payload).encode("utf-8"), headers)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/health":
+            return self._json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+        self._json(HTTPStatus.OK, {"status": "ok", "workers": self.server.jobs, "max_request_bytes": self.server.max_bytes})
+
+    def _admit(self):
+        """Check a POST's path and headers and take a worker slot.
+
+        Returns None once admitted, else the error response to send. Nothing
+        here reads the body, so refused uploads are never held in memory.
+        """
+        url = urlsplit(self.path)
+        if url.path not in ROUTES:
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown endpoint; use one of {', '.join(ROUTES)}"}
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        length = self.headers.get("Content-Length", "")
+        if not length.isdigit():
+            return HTTPStatus.LENGTH_REQUIRED, {"error": "Content-Length is required"}
+        length = int(length)
+        if length > self.server.max_bytes:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": f"Request body is over the {self.server.max_bytes} byte limit"}
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type not in INPUT_TYPES:
+            return HTTPStatus.UNSUPPORTED_MEDIA_TYPE, {"error": f"Content-Type must be one of {', '.join(INPUT_TYPES)}"}
+        fmt = query.get("format", "json")
+        if fmt not in ("json", "csv", "xlsx"):
+            return HTTPStatus.BAD_REQUEST, {"error": "format must be json, csv or xlsx"}
+        try:
+            options = ROUTES[url.path][0](query)
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+
+        if not self.server.slots.acquire(blocking=False):
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Server busy, try again shortly"}, {"Retry-After": "5"}
+        self.admitted = (url.path, INPUT_TYPES[content_type], options, fmt, length)
+        return None
+
+    def _discard_body(self):
+        # Drain a refused upload in small pieces, so the client can read the response
+        length = self.headers.get("Content-Length", "")
+        remaining = int(length) if length.isdigit() else 0
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+
+    def handle_expect_100(self):
+        # Clients that wait for "100 Continue" (curl does for large bodies) are refused before they upload
+        if self.command == "POST":
+            error = self._admit()
+            if error is not None:
+                self.close_connection = True
+                self._json(*error)
+                return False
+        return super().handle_expect_100()
+
+    admitted = None
+
+    def do_POST(self):
+        self.close_connection = True
+        if self.admitted is None:
+            error = self._admit()
+            if error is not None:
+                self._discard_body()
+                return self._json(*error)
+
+        route, name, options, fmt, length = self.admitted
+        try:
+            data = self.rfile.read(length)
+            future = self.server.pool.submit(run_request, route, data, name, options, fmt)
+            del data
+            status, content_type, body, record = future.result()
+        except Exception as e:
+            return self._json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            self.admitted = None
+            self.server.slots.release()
+
+        if status != HTTPStatus.OK:
+            return self._json(status, record)
+        headers = {} if fmt == "json" else {"X-Moderation-Summary": json.dumps(record)}
+        self._send(status, content_type, body, headers)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m engine.server", description="Serve moderation over local HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE, help="requests allowed to wait for a worker")
+    parser.add_argument("--max-mb", type=float, default=MAX_REQUEST_BYTES / 2**20, help="largest request body in MB")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = ModerationServer((args.host, args.port), args.jobs, args.queue, int(args.max_mb * 2**20))
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with {server.jobs} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
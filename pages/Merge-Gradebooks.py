@@ -0,0 +1,102 @@
+import streamlit as st
+
+from engine import export, ingest, instrument, merge
+import ui
+
+st.set_page_config(page_title="Merge Gradebooks", layout="centered", initial_sidebar_state="collapsed")
+
+# HIDE DEFAULT STREAMLIT NAVIGATION
+hide_nav_style = """
+    <style>
+    [data-testid="stSidebarNav"] {display: none;}
+    </style>
+"""
+st.markdown(hide_nav_style, unsafe_allow_html=True)
+
+st.page_link("app.py", label="Back to Home", icon="🏠")
+
+st.title("🧩 Merge Gradebooks")
+st.write(
+    "Combine partial exports for one course (e.g. a quiz gradebook and an exam gradebook) into one sheet, "
+    "then send it to the Gradebook Resolver or to Moodle moderation."
+)
+
+# Opt-in diagnostics: MODERATOR_PROFILE=1 or ?profile=1
+profiler = instrument.session_profiler(st.session_state, "merge", instrument.enabled(st.query_params.get("profile")))
+
+uploaded_files = st.file_uploader(
+    "📤 Step 1: Upload two or more gradebooks (CSV or Excel)",
+    type=["csv", "xlsx"],
+    accept_multiple_files=True
+)
+
+identity = st.selectbox("Step 2: Match students by", list(merge.IDENTITY_KEYS))
+
+if uploaded_files and len(uploaded_files) < 2:
+    st.info("Upload at least one more gradebook to merge.")
+
+elif uploaded_files:
+    # Each file is parsed once per distinct content, as on the other pages
+    with profiler.stage("load"):
+        frames, digests = {}, []
+        labels = merge.file_labels([uploaded_file.name for uploaded_file in uploaded_files])
+        for label, uploaded_file in zip(labels, uploaded_files):
+            df, digest = ingest.load_bytes(uploaded_file.getvalue(), uploaded_file.name)
+            frames[label] = df
+            digests.append(digest)
+
+    try:
+        with profiler.stage("merge"):
+            result = merge.merge_cached(frames, digests, merge.IDENTITY_KEYS[identity])
+    except ValueError as e:
+        st.warning(f"⚠️ {e}. Choose an identity that every file contains.")
+    else:
+        merge_digest = merge.merge_key(digests, merge.IDENTITY_KEYS[identity])
+
+        st.subheader("📋 Merge Summary")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric(label="Students", value=len(result.df))
+        with col2:
+            st.metric(label="In every file", value=result.matched)
+        with col3:
+            st.metric(label="Unmatched", value=len(result.unmatched))
+        with col4:
+            st.metric(label="Rows skipped", value=len(result.skipped))
+
+        st.subheader("👀 Merged Gradebook Preview")
+        st.dataframe(result.df.head(20))
+
+        if not result.unmatched.empty:
+            with st.expander(f"🔎 {len(result.unmatched)} students are missing from at least one file"):
+                st.dataframe(result.unmatched, width="stretch")
+        if not result.skipped.empty:
+            with st.expander(f"🚫 {len(result.skipped)} rows were skipped"):
+                st.caption("Row numbers are spreadsheet lines, counting the header as line 1.")
+                st.dataframe(result.skipped, width="stretch")
+
+        st.subheader("➡️ Step 3: Continue with the merged gradebook")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("🤼‍♂️ Resolve duplicates"):
+                st.session_state.merged_gradebook = (result.df, merge_digest)
+                st.switch_page("pages/Moodle-Gradebook-Resolver.py")
+        with col2:
+            if st.button("📝 Moderate on Moodle"):
+                # Picked up by the Moodle page as if it had been uploaded there
+                st.session_state.df = result.df
+                st.session_state.df_digest = merge_digest
+                st.session_state.df_source = None
+                st.session_state.df_name = "merged_gradebook.csv"
+                st.session_state.moderated_key = None
+                st.switch_page("pages/Moodle_moderation.py")
+        with col3:
+            st.download_button(
+                "📥 Download merged CSV",
+                data=profiler.deferred(export.deferred(merge_digest, "csv", lambda: result.df), "export_csv"),
+                file_name="merged_gradebook.csv",
+                mime=export.CSV_MIME,
+                on_click="ignore"
+            )
+
+ui.diagnostics(profiler)
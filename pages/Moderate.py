@@ -1,9 +1,9 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
 import os
-from io import BytesIO
-import plotly.express as px
+
+from engine import canvas, export, ingest, instrument, memo, numeric
+import ui
 
 st.set_page_config(page_title="Moderation on Canvas", layout="centered", initial_sidebar_state="collapsed")
 
@@ -25,16 +25,78 @@ original_filename = uploaded_file.name if uploaded_file else "uploaded_file.csv"
 base_name, ext = os.path.splitext(original_filename)
 new_filename = f"{base_name}_updated{ext}"
 
+def show_dashboard(session_counts):
+    # Dashboard: Display count of adjusted, pass, and assessment not taken
+    st.subheader("Dashboard: Summary of Results")
+
+    # Show metrics as cards
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric(label="Total Reg. Candidates", value=session_counts.sum())
+    with col2:
+        st.metric(label="Adjusted", value=session_counts.get('Adjusted', 0))
+    with col3:
+        st.metric(label="Pass", value=session_counts.get('Pass', 0))
+    with col4:
+        st.metric(label="Fail", value=session_counts.get('Fail', 0))
+    with col5:
+        st.metric(label="Assessment not taken", value=session_counts.get('Assessment not taken', 0))
+
+    # Pie chart of the breakdown of results; plotly is imported on the first chart, not at startup
+    import plotly.express as px
+
+    fig = px.pie(session_counts, names=session_counts.index, values=session_counts.values, title="Results Breakdown")
+    st.plotly_chart(fig)
+
+
+def show_section_table(section_table):
+    st.subheader("Dashboard by Section")
+    st.dataframe(section_table, width="stretch")
+
+
+def show_download(data):
+    st.info("If you're satisfied with the moderation, click the button below 👇 to download the moderated result 🤗 and refresh the page to moderate another exams.")
+    st.download_button(
+        label="📥 Download Updated CSV",
+        data=data,
+        file_name=new_filename,
+        mime=export.CSV_MIME
+    )
+
+
+@st.cache_data(max_entries=4)
+def scan_upload(file_id, _uploaded_file):
+    # Streaming mode: header and sections without parsing the whole file into memory
+    return ingest.read_header(_uploaded_file), canvas.scan_sections(_uploaded_file)
+
+
+ALL_SECTIONS = "All sections"
+
+# Opt-in diagnostics: MODERATOR_PROFILE=1 or ?profile=1
+profiler = instrument.session_profiler(st.session_state, "canvas", instrument.enabled(st.query_params.get("profile")))
+
+stream_mode = st.toggle(
+    "Streaming mode for very large files",
+    help=f"Reads the CSV in chunks of {canvas.STREAM_CHUNK_ROWS:,} rows and writes the moderated file incrementally."
+)
+
 if uploaded_file:
-    df = pd.read_csv(uploaded_file)
+    with profiler.stage("load"):
+        if stream_mode:
+            columns, sessions = scan_upload(uploaded_file.file_id, uploaded_file)
+        else:
+            df, digest = ingest.load_bytes(uploaded_file.getvalue(), uploaded_file.name)
+            columns, sessions = df.columns, df["Section"].dropna().unique()
 
     st.success("✅ File uploaded successfully!")
+    if not stream_mode and ingest.memory_report(df):
+        st.caption(f"In memory: {ingest.memory_report(df)}")
 
-    # Display unique sessions for selection
-    sessions = df["Section"].dropna().unique()
-    selected_session = st.selectbox("Step 2: Select a Session to Filter", sorted(sessions))
+    # Display unique sessions for selection; "All sections", listed last, moderates every session at once
+    selected_session = st.selectbox("Step 2: Select a Session to Filter", sorted(sessions) + [ALL_SECTIONS])
+    section = None if selected_session == ALL_SECTIONS else selected_session
 
-    score_columns = st.multiselect("Step 3: Select columns used for total score calculation:", df.columns, max_selections=3)
+    score_columns = st.multiselect("Step 3: Select columns used for total score calculation:", columns, max_selections=3)
 
     column_to_be_adjusted = st.selectbox("Select the column to be updated", sorted(score_columns))
 
@@ -43,142 +105,76 @@ if uploaded_file:
     if score_columns and selected_session and threshold is not None:
         st.subheader("Processed Results")
 
-        # Filter dataframe based on selected session
-        session_df = df[df["Section"] == selected_session].copy()
-
-        # Keep only rows that have values in all selected score_columns
-        valid_rows_mask = session_df[score_columns].notna().all(axis=1)
-        valid_df = session_df[valid_rows_mask].copy()
-
-        def adjust_row(row):
-            values = row[score_columns].fillna(0)
-            total = values.sum()
-            if (total >= threshold and total < 40):
-                shortfall = 40 - total
-                values.iloc[-1] = min(values.iloc[-1] + shortfall, 40)  # Cap to 100 if needed
-                adjusted_total = values.sum()
-                return pd.Series([adjusted_total, f"Adjusted by {shortfall}"])
-            else:
-                return pd.Series([total, "No adjustment needed"])
-
-        # Convert selected columns to numeric
-        valid_df[score_columns] = valid_df[score_columns].apply(pd.to_numeric, errors='coerce')
-
         try:
-            # Apply adjustment only to valid rows
-            valid_df[["Adjusted Total", "Adjustment Note"]] = valid_df.apply(adjust_row, axis=1)
-
-            # Merge back into original dataframe
-            updated_df = df.copy()
-            updated_df.loc[session_df.index, "Adjusted Total"] = valid_df["Adjusted Total"]
-            updated_df.loc[session_df.index, "Adjustment Note"] = valid_df["Adjustment Note"]
-
-            st.dataframe(updated_df)
-
-            final_df = updated_df.copy()
-            score_columns_without_selected = [col for col in score_columns if col != column_to_be_adjusted]
-
-            result_series = updated_df["Adjusted Total"] - updated_df[score_columns_without_selected].apply(pd.to_numeric, errors='coerce').sum(axis=1)
-
-            # Convert to a DataFrame with column name "New_Scores"
-            new_df = pd.DataFrame({"New_Scores": result_series})
-
-            updated_df[column_to_be_adjusted] = pd.to_numeric(updated_df[column_to_be_adjusted], errors='coerce')
-            adjusted_total_numeric = pd.to_numeric(updated_df["Adjusted Total"], errors='coerce')
-
-            # Data for summary statistics
-            conditions = [
-                updated_df["Adjustment Note"].str.contains(r'^Adjusted\s+by', case=False, na=False),  # Check if "Adjust by" exists
-                (updated_df["Adjustment Note"].str.contains(r'\bNo\s+adjustment\s+needed\b', case=False, na=False)) & 
-                (adjusted_total_numeric >= 40),
-                updated_df[score_columns].isna().any(axis=1)
-            ]
-
-            # Corresponding values for the conditions
-            choices = ['Adjusted', 'Pass', 'Assessment not taken']
-
-            # Default value if none of the conditions match
-            default_choice = 'Fail'
-            
-            # Apply the conditions to create the new column
-            updated_df['comment'] = np.select(conditions, choices, default=default_choice)
-
-            # Dashboard: Display count of adjusted, pass, and assessment not taken
-            session_counts = updated_df[updated_df["Section"] == selected_session]['comment'].value_counts()
-            st.subheader("Dashboard: Summary of Results")
-
-            # # Number of candidates who didn't write either of the assessments
-            # number_of_candidates_who_did_not_write_either_assessment = updated_df[updated_df["Section"] == selected_session][score_columns].isna().sum().sum()
-            # st.write(f"Candidates who didn't write either assessment: {number_of_candidates_who_did_not_write_either_assessment}")
-
-            # Show metrics as cards
-            col1, col2, col3, col4, col5 = st.columns(5)
-            with col1:
-                st.metric(label="Total Reg. Candidates", value=session_counts.sum())
-            with col2:
-                st.metric(label="Adjusted", value=session_counts.get('Adjusted', 0))
-            with col3:
-                st.metric(label="Pass", value=session_counts.get('Pass', 0))
-            with col4:
-                st.metric(label="Fail", value=session_counts.get('Fail', 0))
-            with col5:
-                st.metric(label="Assessment not taken", value=session_counts.get('Assessment not taken', 0))
-
-            updated_df[updated_df["Section"] == selected_session][score_columns].isna().sum()
-
-            
-            # Pie chart of the breakdown of results
-            fig = px.pie(session_counts, names=session_counts.index, values=session_counts.values, title="Results Breakdown")
-            st.plotly_chart(fig)
-
-            # Breakdown of adjusted and non-adjusted students
-            st.subheader("Details of Adjusted Students")
-            filtered_df = updated_df[
-                (updated_df["Adjustment Note"].str.contains(r'^Adjusted\s+by', case=False, na=False)) |
-                (updated_df["Section"] == selected_session) &
-                (updated_df["comment"] == "Fail")
-            ]
-            st.dataframe(filtered_df)
-
-
-            # Display the new scores column adjustment
-            updated_df[column_to_be_adjusted] = np.where(
-                new_df['New_Scores'] > updated_df[column_to_be_adjusted],
-                new_df['New_Scores'].map(lambda x: f"{x:.2f}" if pd.notnull(x) else x).astype(object),
-                updated_df[column_to_be_adjusted].map(lambda x: f"{x:.2f}" if pd.notnull(x) else x).astype(object)
-            )
-
-            st.subheader("Number of Students Who Didn't Take Assessment")
-            # Calculate missing values per assessment
-            missing_counts = updated_df[updated_df["Section"] == selected_session][score_columns].isna().sum()
-
-            # Convert to DataFrame with descriptive column names
-            missing_df = pd.DataFrame({
-                "Assessment Type": missing_counts.index,
-                "Number of Students": missing_counts.values
-            })
-
-            # Display
-            st.dataframe(missing_df)
-
-
-            st.info("If you're satisfied with the moderation, click the button below 👇 to download the moderated result 🤗 and refresh the page to moderate another exams.")
-            # Downloadable Excel
-            updated_df_download = updated_df.drop(columns=["Adjusted Total", "Adjustment Note", "comment"])
-            output = BytesIO()
-            updated_df_download.to_csv(output, index=False)
-            st.download_button(
-                label="📥 Download Updated CSV",
-                data=output.getvalue(),
-                file_name=new_filename,
-                mime="text/csv"
-            )
+            if stream_mode:
+                # Moderate chunk by chunk into a file on disk, once per file and settings;
+                # only the download reads it back
+                stream_key = memo.fingerprint(uploaded_file.file_id, selected_session, tuple(score_columns), column_to_be_adjusted, threshold)
+                streamed = st.session_state.get("canvas_stream")
+                if streamed is None or streamed[0] != stream_key:
+                    output = export.TempExport()
+                    with profiler.stage("stream"), open(output.path, "wb") as handle:
+                        uploaded_file.seek(0)
+                        summary = canvas.stream_section(
+                            uploaded_file, handle, section, score_columns, column_to_be_adjusted, threshold
+                        )
+                    streamed = st.session_state.canvas_stream = (stream_key, summary, output)
+                _, summary, output = streamed
+
+                with profiler.stage("dashboard"):
+                    show_dashboard(summary.counts)
+                    if section is None:
+                        show_section_table(summary.sections)
+
+                st.subheader("Details of Adjusted Students")
+                st.caption(f"Showing up to {canvas.STREAM_DETAIL_ROWS:,} students in streaming mode.")
+                st.dataframe(summary.details)
+
+                st.subheader("Number of Students Who Didn't Take Assessment")
+                st.dataframe(pd.DataFrame({
+                    "Assessment Type": summary.missing.index,
+                    "Number of Students": summary.missing.values
+                }))
+
+                show_download(profiler.deferred(output.read, "export_csv"))
+            else:
+                # Adjust every valid student in the selected session in one pass
+                with profiler.stage("moderate"):
+                    result = canvas.moderate_section(df, section, score_columns, column_to_be_adjusted, threshold)
+
+                st.dataframe(result.df.drop(columns=["comment"]))
+
+                # Filled score cells that are not numbers, from the cached numeric view
+                failed = numeric.failed_cells(df, score_columns)
+                if not failed.empty:
+                    with st.expander(f"🧹 {len(failed)} score cells could not be read as numbers"):
+                        st.dataframe(failed.head(1000), width="stretch")
+
+                with profiler.stage("dashboard"):
+                    show_dashboard(canvas.comment_counts(result))
+                    if section is None:
+                        show_section_table(canvas.section_counts(result))
+
+                with profiler.stage("tables"):
+                    # Breakdown of adjusted and non-adjusted students
+                    st.subheader("Details of Adjusted Students")
+                    st.dataframe(canvas.adjusted_details(result))
+
+                    st.subheader("Number of Students Who Didn't Take Assessment")
+                    st.dataframe(canvas.missing_assessments(result))
+
+                # Downloadable CSV, built only when the button is clicked
+                export_key = memo.fingerprint(digest, selected_session, tuple(score_columns), column_to_be_adjusted, threshold)
+                show_download(profiler.deferred(
+                    export.deferred(export_key, "csv", lambda: canvas.export_frame(result)), "export_csv"
+                ))
         except ValueError as e:
             # If the ValueError is raised, print a custom error message
             st.info("I think you've made a mistake🤔: Kindly choose the correct Cohort/Session and Score Columns.")
     else:
         st.info("Please make sure you've selected a session and score columns.")
 
+ui.diagnostics(profiler)
 
 st.markdown(
     """
@@ -1,17 +1,42 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-from io import BytesIO
 import re
 import os
 
+from engine import export, ingest, instrument, jobs, memo, resolver
+import ui
+
 
 st.set_page_config(page_title="Moodle Gradebook Resolver", layout="wide")
 
-def normalize_col(col):
-    col = col.strip()
-    col = re.sub(r"\.\d+$", "", col)  # remove .1, .2, .3
-    return col
+# Rows of the detected-groups table shown at a time
+GROUPS_PER_PAGE = 50
+
+
+@st.cache_data(max_entries=4)
+def scan_upload(file_id, _uploaded_file):
+    # Streaming mode: header and a few rows, without parsing the whole file into memory
+    preview = pd.read_csv(_uploaded_file, nrows=5)
+    _uploaded_file.seek(0)
+    return preview.columns.tolist(), preview
+
+
+def stream_to_file(source, column_groups):
+    # Runs as a background job: chunk by chunk into a file on disk; only one chunk is in memory at a time
+    job = jobs.current()
+
+    def report_progress(rows, fraction):
+        job.report(fraction, f"Resolved {rows:,} rows")
+
+    output = export.TempExport()
+    with open(output.path, "wb") as handle:
+        source.seek(0)
+        summary = resolver.stream_resolve(source, handle, column_groups, progress=report_progress)
+    return summary, output
+
+
+# Opt-in diagnostics: MODERATOR_PROFILE=1 or ?profile=1
+profiler = instrument.session_profiler(st.session_state, "resolver", instrument.enabled(st.query_params.get("profile")))
 
 col1, col2, col3 = st.columns([1, 3, 1])
 with col1:
@@ -25,7 +50,8 @@ with col2:
         
         **Logic used:**
         - If a student has **no score in all selected duplicate columns** → result is empty
-        - If a student has **scores in one or more columns** → highest score is used
+        - If a student has **scores in one or more columns** → highest score is used by default;
+          each group can instead take the average, the first or last non-empty score, or the sum
         """
     )
 
@@ -37,21 +63,49 @@ with col2:
         type=["csv", "xlsx"]
     )
 
-    if uploaded_file:
-        # Read file
-        if uploaded_file.name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
+    stream_mode = st.toggle(
+        "Streaming mode for very large CSV files",
+        help=f"Resolves the CSV in chunks of {resolver.STREAM_CHUNK_ROWS:,} rows and writes the result to a "
+             "temporary file, so no full table is built. The upload itself is still held in memory; for "
+             "exports too large for that, use `python -m engine.cli resolve`."
+    )
+
+    # A gradebook sent from Merge Gradebooks is used until a file is uploaded here
+    merged = None if uploaded_file else st.session_state.get("merged_gradebook")
+    if merged is not None:
+        st.info("Using the merged gradebook from Merge Gradebooks. Upload a file to replace it.")
+        stream_mode = False
+
+    if uploaded_file or merged is not None:
+        if stream_mode and not ingest.is_csv(uploaded_file.name):
+            st.info("Streaming mode reads CSV files only; this Excel file is loaded in full.")
+            stream_mode = False
+
+        # Read file (cached by content, so widget changes don't re-parse it)
+        with profiler.stage("load"):
+            if stream_mode:
+                columns, preview = scan_upload(uploaded_file.file_id, uploaded_file)
+                # Keys the per-group choices below; streaming never hashes the whole file
+                digest = uploaded_file.file_id
+            elif merged is not None:
+                df, digest = merged
+                columns, preview = df.columns, df.head()
+            else:
+                df, digest = ingest.load_bytes(uploaded_file.getvalue(), uploaded_file.name)
+                columns, preview = df.columns, df.head()
 
-        st.success("File uploaded successfully!")
+        if uploaded_file:
+            st.success("File uploaded successfully!")
 
         st.subheader("📄 Raw Data Preview")
-        st.dataframe(df.head())
+        st.dataframe(preview)
+        memory_saved = None if stream_mode else ingest.memory_report(df)
+        if memory_saved:
+            st.caption(f"In memory: {memory_saved}")
 
         
         # Extracting the uploaded file to name the Resolved filename
-        original_filename = uploaded_file.name
+        original_filename = uploaded_file.name if uploaded_file else "merged_gradebook"
         base_filename = os.path.splitext(original_filename)[0]
         safe_name = re.sub(r"[^\w\s-]", "", base_filename)
         resolved_filename = f"{safe_name}_resolved_gradebook"
@@ -72,32 +126,64 @@ with col2:
         # -------------------------------
         if mode == "Automatically detect duplicates":
 
-            normalized_map = {}
-
-            for col in df.columns:
-                base = normalize_col(col)
-                normalized_map.setdefault(base, []).append(col)
-
-            auto_duplicates = {
-                base: cols for base, cols in normalized_map.items() if len(cols) > 1
-            }
+            with profiler.stage("detect"):
+                auto_duplicates = resolver.detect_duplicates(columns)
 
             if not auto_duplicates:
                 st.info("No duplicated columns detected automatically.")
             else:
                 st.subheader("🔁 Detected Duplicate Groups")
 
-                for base_col, cols in auto_duplicates.items():
-                    resolved_name = f"{base_col} (Resolved)"
-
-                    with st.expander(f"{base_col}"):
-                        st.write("Columns to be merged:")
-                        st.write(cols)
+                default_strategy = st.selectbox(
+                    "Resolution rule for all groups",
+                    list(resolver.STRATEGY_LABELS),
+                    format_func=resolver.STRATEGY_LABELS.get
+                )
+                # Per-group choices that differ from the default, kept per file across reruns
+                overrides = st.session_state.setdefault("strategy_overrides", {}).setdefault(digest, {})
+
+                column_groups = {
+                    base_col: {
+                        "selected": cols,
+                        "resolved_name": resolver.resolved_name(base_col),
+                        "strategy": overrides.get(base_col, default_strategy)
+                    }
+                    for base_col, cols in auto_duplicates.items()
+                }
 
-                        column_groups[base_col] = {
-                            "selected": cols,
-                            "resolved_name": resolved_name
-                        }
+                # One table instead of an expander per group keeps thousands of groups responsive
+                search = st.text_input("Search groups", placeholder="Activity or column name")
+                groups_table = resolver.group_table(auto_duplicates, search)
+
+                pages = max(1, -(-len(groups_table) // GROUPS_PER_PAGE))
+                page = st.number_input("Page", min_value=1, max_value=pages, step=1) if pages > 1 else 1
+                start = (page - 1) * GROUPS_PER_PAGE
+
+                page_table = groups_table.iloc[start:start + GROUPS_PER_PAGE]
+                page_table.insert(2, "Resolution", [
+                    resolver.STRATEGY_LABELS[column_groups[group]["strategy"]] for group in page_table["Group"]
+                ])
+                edited = st.data_editor(
+                    page_table,
+                    column_config={"Resolution": st.column_config.SelectboxColumn(
+                        options=list(resolver.STRATEGY_LABELS.values()), required=True
+                    )},
+                    disabled=[col for col in page_table.columns if col != "Resolution"],
+                    width="stretch", hide_index=True,
+                    key=f"groups_{page}_{search}"
+                )
+                strategy_by_label = {label: name for name, label in resolver.STRATEGY_LABELS.items()}
+                for group, label in zip(edited["Group"], edited["Resolution"]):
+                    strategy = strategy_by_label[label]
+                    column_groups[group]["strategy"] = strategy
+                    if strategy == default_strategy:
+                        overrides.pop(group, None)
+                    else:
+                        overrides[group] = strategy
+                st.caption(
+                    f"Showing {min(start + 1, len(groups_table))}–{min(start + GROUPS_PER_PAGE, len(groups_table))} "
+                    f"of {len(groups_table)} groups ({len(auto_duplicates)} detected). All detected groups are merged."
+                )
 
         # -------------------------------
         # MANUAL MODE
@@ -107,89 +193,119 @@ with col2:
 
             selected_cols = st.multiselect(
                 "Select columns to merge",
-                options=df.columns.tolist()
+                options=list(columns)
             )
 
             if selected_cols:
-                base_name = normalize_col(selected_cols[0])
-                resolved_name = f"{base_name} (Resolved)"
+                base_name = resolver.normalize_col(selected_cols[0])
+                resolved_name = resolver.resolved_name(base_name)
 
                 st.info(f"Resolved column will be named: **{resolved_name}**")
 
+                strategy = st.selectbox(
+                    "Resolution rule",
+                    list(resolver.STRATEGY_LABELS),
+                    format_func=resolver.STRATEGY_LABELS.get
+                )
+
                 column_groups["manual"] = {
                     "selected": selected_cols,
-                    "resolved_name": resolved_name
+                    "resolved_name": resolved_name,
+                    "strategy": strategy
                 }
         # -------------------------------
         # Analyze Button
         # -------------------------------
-        if st.button("🔍 Analyze"):
-            resolved_df = df.copy()
-
-            for group in column_groups.values():
-                cols = group["selected"]
-                resolved_name = group["resolved_name"]
-
-                # Convert to numeric safely
-                temp = resolved_df[cols].apply(pd.to_numeric, errors="coerce")
-
-                # Row-wise resolution
-                def resolve_row(row):
-                    if row.isna().all():
-                        return np.nan
-                    return row.max()
-
-                resolved_df[resolved_name] = temp.apply(resolve_row, axis=1)
-
-
-
-            st.subheader("👀 Preview: With Duplicates + Resolved Columns")
-            st.dataframe(resolved_df.head(20))
-
-            # -------------------------------
-            # Prepare final download version
-            # -------------------------------
-            drop_cols = []
-            keep_cols = []
-
-            for group in column_groups.values():
-                drop_cols.extend(group["selected"])
-                keep_cols.append(group["resolved_name"])
-
-            final_df = resolved_df.drop(columns=drop_cols)
-
-            st.subheader("✅ Final Sheet (Duplicates Dropped)")
-            st.dataframe(final_df.head(20))
-
-            # -------------------------------
-            # Download Section
-            # -------------------------------
-            st.subheader("⬇️ Download Resolved Gradebook")
-
-            col1, col2 = st.columns(2)
+        # Files are keyed by the upload and the groups; results stay on screen while these are unchanged
+        export_key = memo.fingerprint(
+            digest, [(tuple(g["selected"]), g["resolved_name"], g["strategy"]) for g in column_groups.values()]
+        )
+        job_key = memo.fingerprint(export_key, stream_mode)
+        job = st.session_state.get("resolver_job")
 
-            with col1:
-                csv = final_df.to_csv(index=False).encode("utf-8")
+        # Resolution runs in the background, so the page stays usable and can cancel it
+        if st.button("🔍 Analyze"):
+            if job is not None:
+                job.cancel()
+            if stream_mode:
+                job = jobs.submit(
+                    profiler.deferred(stream_to_file, "stream"), uploaded_file, column_groups,
+                    name="resolve", key=job_key
+                )
+            else:
+                # All groups are coerced once and reduced in one pass per resolution rule
+                job = jobs.submit(
+                    profiler.deferred(resolver.resolve, "resolve"), df, column_groups,
+                    name="resolve", key=job_key, stages=resolver.STAGES
+                )
+            st.session_state.resolver_job = job
+
+        if job is not None and job.key == job_key:
+            if not job.done:
+                ui.job_progress(job)
+            elif job.state == jobs.FAILED:
+                st.error(f"Resolution failed: {job.error}")
+            elif job.state == jobs.CANCELLED:
+                st.info("Resolution cancelled.")
+            elif stream_mode:
+                summary, output = job.result
+
+                st.subheader("✅ Final Sheet (Duplicates Dropped)")
+                st.caption(f"{summary.rows:,} rows resolved in streaming mode; showing the first {len(summary.preview)}.")
+                st.dataframe(summary.preview)
+
+                st.subheader("⬇️ Download Resolved Gradebook")
                 st.download_button(
                     "Download as CSV",
-                    data=csv,
+                    data=profiler.deferred(output.read, "export_csv"),
                     file_name=f"{resolved_filename}.csv",
-                    mime="text/csv"
-                )
-
-
-            with col2:
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                    final_df.to_excel(writer, index=False, sheet_name="Resolved")
-                st.download_button(
-                    "Download as Excel",
-                    data=output.getvalue(),
-                    file_name=f"{resolved_filename}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    mime=export.CSV_MIME,
+                    on_click="ignore"
                 )
+            else:
+                resolved_df = job.result
+
+                st.subheader("👀 Preview: With Duplicates + Resolved Columns")
+                st.dataframe(resolved_df.head(20))
+
+                # -------------------------------
+                # Prepare final download version
+                # -------------------------------
+                final_df = resolver.final_frame(resolved_df, column_groups)
+
+                st.subheader("✅ Final Sheet (Duplicates Dropped)")
+                st.dataframe(final_df.head(20))
+
+                # -------------------------------
+                # Download Section
+                # -------------------------------
+                st.subheader("⬇️ Download Resolved Gradebook")
+
+                # Files are serialized only when a button is clicked; "ignore" skips the rerun
+                col1, col2 = st.columns(2)
+
+                with col1:
+                    st.download_button(
+                        "Download as CSV",
+                        data=profiler.deferred(export.deferred(export_key, "csv", lambda: final_df), "export_csv"),
+                        file_name=f"{resolved_filename}.csv",
+                        mime=export.CSV_MIME,
+                        on_click="ignore"
+                    )
+
+
+                with col2:
+                    st.download_button(
+                        "Download as Excel",
+                        data=profiler.deferred(export.deferred(export_key, "xlsx", lambda: final_df, "Resolved"), "export_xlsx"),
+                        file_name=f"{resolved_filename}.xlsx",
+                        mime=export.XLSX_MIME,
+                        on_click="ignore"
+                    )
 
     else:
         st.info("👆 Upload a CSV or Excel gradebook to begin.")
+
+    ui.diagnostics(profiler)
 with col3:
     st.write("")
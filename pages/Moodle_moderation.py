@@ -1,10 +1,8 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import io
 import os
-from io import BytesIO
+
+from engine import export, ingest, instrument, jobs, memo, moodle, numeric
+import ui
 
 st.set_page_config(page_title="Moderation on Moodle", layout="centered", initial_sidebar_state="collapsed")
 
@@ -19,26 +17,6 @@ st.markdown(hide_nav_style, unsafe_allow_html=True)
 st.page_link("app.py", label="Back to Home", icon="🏠")
 
 
-# --- Helper functions ---
-def round_boundary(score):
-    if score in [39, 44, 49, 59, 69]:
-        return score + 1
-    return score
-
-def assign_grade(score):
-    if score < 40:
-        return "F"
-    elif score < 45:
-        return "E"
-    elif score < 50:
-        return "D"
-    elif score < 60:
-        return "C"
-    elif score < 70:
-        return "B"
-    else:
-        return "A"
-
 # --- App Layout ---
 st.title("📊 Exam Moderation Tool")
 
@@ -46,22 +24,65 @@ st.title("📊 Exam Moderation Tool")
 def init_session():
     if "df" not in st.session_state:
         st.session_state.df = None
+        st.session_state.df_digest = None
+        st.session_state.df_source = None
+        st.session_state.df_name = None
+    if "moderated_key" not in st.session_state:
+        st.session_state.moderated_key = None
 
 init_session()
 
+def pick_threshold():
+    # Runs before the rerun, so the threshold widget can still be set
+    points = st.session_state.threshold_sweep.selection.points
+    if points:
+        st.session_state.threshold = int(points[0]["x"])
+        st.session_state.apply_threshold = True
+
+
+def run_moderation(df, digest, columns, update_field, threshold):
+    # Runs as a background job; the what-if curve starts from the threshold-0 result, so warm that too
+    result = moodle.moderate_cached(df, digest, columns, update_field, threshold)
+    if threshold:
+        moodle.moderate_cached(df, digest, columns, update_field, 0)
+    return result
+
+
+# Opt-in diagnostics: MODERATOR_PROFILE=1 or ?profile=1
+profiler = instrument.session_profiler(st.session_state, "moodle", instrument.enabled(st.query_params.get("profile")))
+
 uploaded_file = st.file_uploader("Upload CSV or Excel file", type=["csv", "xlsx"])
 
-if uploaded_file and st.session_state.df is None:
-    if uploaded_file.name.endswith("csv"):
-        st.session_state.df = pd.read_csv(uploaded_file)
-    else:
-        st.session_state.df = pd.read_excel(uploaded_file)
+projected_mode = st.toggle(
+    "Load only the columns used (wide gradebooks)",
+    help="Reads the header first, then only the identity and selected columns. "
+         "The other columns are added back when the file is downloaded."
+)
+
+# Parsed once per distinct file; reruns and re-uploads of the same bytes hit the cache
+if uploaded_file:
+    st.session_state.df_name = uploaded_file.name
+    with profiler.stage("load"):
+        if projected_mode:
+            # Phase 1: header and a few rows for the pickers; phase 2 happens on moderation
+            st.session_state.df, digest = ingest.load_preview(uploaded_file.getvalue(), uploaded_file.name)
+            st.session_state.df_digest = memo.fingerprint(digest, "projected")
+            st.session_state.df_source = (uploaded_file.getvalue(), uploaded_file.name)
+        else:
+            # Moodle's "-" (not graded) stays as text and reads as a blank score when moderating
+            st.session_state.df, st.session_state.df_digest = ingest.load_bytes(uploaded_file.getvalue(), uploaded_file.name)
+            st.session_state.df_source = None
 
 if st.session_state.df is not None:
-    df = st.session_state.df.copy()
+    # Shared with the parse cache and the numeric view cache: read-only here
+    df = st.session_state.df
+    source = st.session_state.df_source
 
     st.subheader("Preview of Uploaded Data")
     st.dataframe(df.head())
+    memory_saved = ingest.memory_report(df)
+    if memory_saved:
+        st.caption(f"In memory: {memory_saved}")
 
     # Step 1: Select columns
     st.subheader("Step 1: Choose Columns for Moderation")
@@ -80,196 +101,122 @@ if st.session_state.df is not None:
     # Step 3: Threshold input
     threshold = st.number_input(
         "Enter threshold for further moderation (leave at 0 for none)",
-        min_value=0, max_value=100, step=1, value=0
+        min_value=0, max_value=100, step=1, key="threshold"
     )
 
+    # Results are memoized on the file and parameters, so reruns that only change
+    # presentation (e.g. the download format) redisplay them without recomputing
+    params_key = moodle.result_key(st.session_state.df_digest, columns, update_field, threshold)
+
+    # A point picked on the what-if curve applies its threshold straight away
+    if st.session_state.pop("apply_threshold", False) and columns and update_field in columns:
+        st.session_state.moderated_key = params_key
+
     # --- When user clicks the moderate button, do all moderation in one pass ---
-if st.button("Moderate Result"):
-
-    if not columns:
-        st.warning("⚠️ Please select at least one column to proceed.")
-    else:
-        # ---------- IMPORTANT: Work on a numeric copy that preserves NaNs ----------
-        # numeric_raw has NaN where scores were not recorded — we will use this
-        selected_data = df[columns]
-        numeric_raw = selected_data.apply(pd.to_numeric, errors="coerce")  # NaNs preserved
-        
-
-        # For arithmetic we will create a filled version when needed:
-        numeric_filled = numeric_raw.fillna(0)
-
-        # ---------- Initial moderation (boundary) ----------
-        df["RawScore"] = numeric_filled.sum(axis=1)
-        df["ModeratedTotalScore"] = df["RawScore"].apply(round_boundary)
-
-        # assign grade only for students who attempted ALL selected assessments (use numeric_raw)
-        df["Grade"] = np.where(
-            numeric_raw.notna().all(axis=1),
-            df["ModeratedTotalScore"].apply(assign_grade),
-            np.nan
-        )
-
-        # Keep a copy BEFORE further moderation for comparisons
-        df_before = df.copy()
-        numeric_raw_before = numeric_raw.copy()
+    if st.button("Moderate Result"):
+
+        if not columns:
+            st.warning("⚠️ Please select at least one column to proceed.")
+        elif update_field not in columns:
+            st.warning("⚠️ The field to update must be one of the columns selected in Step 1.")
+        else:
+            st.session_state.moderated_key = params_key
+
+    if st.session_state.moderated_key is not None and st.session_state.moderated_key != params_key:
+        st.info("Moderation settings have changed — click **Moderate Result** to apply them.")
+
+    if st.session_state.moderated_key == params_key:
+        if source is not None:
+            # Phase 2: parse just the identity and selected columns
+            with profiler.stage("load_columns"):
+                df, _ = ingest.load_projected(*source, columns)
+            st.caption(f"Loaded {df.shape[1]} of {len(st.session_state.df.columns)} columns. "
+                       f"In memory: {ingest.memory_report(df)}")
+
+        result = moodle.result_cache.get(params_key)
+        if result is None:
+            # Not computed yet: moderate in the background and pick the result up when it is ready
+            job = st.session_state.get("moodle_job")
+            if job is None or job.key != params_key:
+                if job is not None:
+                    job.cancel()
+                job = jobs.submit(
+                    profiler.deferred(run_moderation, "moderate"),
+                    df, st.session_state.df_digest, columns, update_field, threshold,
+                    name="moderate", key=params_key, stages=moodle.STAGES
+                )
+                st.session_state.moodle_job = job
+            if not job.done:
+                ui.job_progress(job)
+                st.stop()
+
+            if job.state != jobs.DONE:
+                st.session_state.moodle_job = None
+                st.session_state.moderated_key = None
+                if job.state == jobs.FAILED:
+                    st.error(f"Moderation failed: {job.error}")
+                else:
+                    st.info("Moderation cancelled.")
+                st.stop()
+            result = job.result
 
         try:
-            # ---------- Further moderation (optional) ----------
-            further_count = 0
-            moderated_40_list = pd.DataFrame()
-            if threshold > 0:
-                # Only consider failed students who had a value recorded in the selected update_field
-                # (this prevents turning previously-missing cells into recorded attempts)
-                pre_mask = (
-                    (df["Grade"] == "F") &
-                    (df["ModeratedTotalScore"] >= threshold) &
-                    (df["ModeratedTotalScore"] < 40) &
-                    (numeric_raw[update_field].notna())   # must have had an actual recorded value
+            with profiler.stage("summary"):
+                st.subheader("📋 Summary Table")
+                st.dataframe(moodle.build_summary(result), width="stretch")
+
+                # ---------- Preview moderated results (final) ----------
+                st.subheader("Moderated Results Preview")
+                st.dataframe(moodle.preview_frame(result))
+
+                moderated_40_list = moodle.moderated_list(result)
+
+            # ---------- What-if: every threshold from one histogram ----------
+            with profiler.stage("sweep"):
+                st.subheader("🎚️ Threshold What-If")
+                # Charting libraries are imported when a chart is first drawn, not at startup
+                import plotly.express as px
+
+                sweep = moodle.threshold_sweep_cached(df, st.session_state.df_digest, columns, update_field)
+                sweep_fig = px.line(
+                    sweep.reset_index(), x="Threshold", y=["Moderated to 40", "Pass"],
+                    markers=True, hover_data={"Pass rate": ":.1%"},
+                    labels={"value": "Students", "variable": ""},
+                    title="Students moderated to 40 and passing, by threshold"
                 )
+                st.plotly_chart(sweep_fig, key="threshold_sweep", on_select=pick_threshold, selection_mode="points")
+                st.caption("Click a point to moderate with that threshold.")
+                with st.expander("Grade distribution by threshold"):
+                    st.dataframe(sweep.style.format({"Pass rate": "{:.1%}"}), width="stretch")
 
-                if pre_mask.any():
-                    # compute how much to add to bring each student's ModeratedTotalScore to 40
-                    diff = 40 - df.loc[pre_mask, "ModeratedTotalScore"]
-                    # apply the diff to the numeric_raw (not to df directly)
-                    numeric_raw.loc[pre_mask, update_field] = numeric_raw.loc[pre_mask, update_field].fillna(0) + diff
-
-                    further_count = int(pre_mask.sum())
-
-                    # After changing numeric_raw we must recompute filled sums and moderated total
-                    numeric_filled = numeric_raw.fillna(0)
-                    df["RawScore"] = numeric_filled.sum(axis=1)
-                    df["ModeratedTotalScore"] = df["RawScore"].apply(round_boundary)
-
-                    # Reassign grade only to those who attempted all assessments
-                    df["Grade"] = np.where(
-                        numeric_raw.notna().all(axis=1),
-                        df["ModeratedTotalScore"].apply(assign_grade),
-                        np.nan
-                    )
-
-            # ---------- Compute ModeratedExamScore (final moderated value for the update_field) ----------
-            # Only compute ModeratedExamScore for students who originally had a recorded value in the update_field
-            df["ModeratedExamScore"] = np.where(
-                numeric_raw[update_field].notna(),                               # True if user originally had a value
-                numeric_raw[update_field] + (df["ModeratedTotalScore"] - df["RawScore"]),
-                np.nan  # keep NaN for those with no score recorded in the selected update_field
-            )
-
-            # update the dataframe column used for download / final output without destroying NA info for the others:
-            # We want the moderated column to contain the final moderated value where applicable, and preserve original blanks
-            df[update_field] = df["ModeratedExamScore"].combine_first(df[update_field])
-
-            # ---------- Status classification using numeric_raw (preserves No Score / Incomplete) ----------
-            def classify_status_row(r):
-                nr = numeric_raw.loc[r.name]
-                if nr.isna().all():
-                    return "No Score"
-                elif nr.isna().any():
-                    return "Incomplete"
-                else:
-                    return "Pass" if r["ModeratedTotalScore"] >= 40 else "Fail"
-
-            df["Status"] = df.apply(classify_status_row, axis=1)
-
-            # ---------- Build summary using numeric_raw (so attempted counts are correct) ----------
-            total_students = len(df)
-            attempted_all = numeric_raw.notna().all(axis=1).sum()
-            boundary_count = df["RawScore"].apply(lambda x: x in [39, 44, 49, 59, 69]).sum()
-
-            summary_rows = [
-                ["Total enrolled", total_students, "100%"],
-                ["Attempted all selected assessments", attempted_all, f"{attempted_all/total_students:.1%}"],
-                [f"Attempted {update_field} only (missed others)",
-                    ((numeric_raw[update_field].notna()) & (numeric_raw.drop(columns=[update_field]).isna().any(axis=1))).sum(),
-                    f"{((numeric_raw[update_field].notna()) & (numeric_raw.drop(columns=[update_field]).isna().any(axis=1))).sum()/total_students:.1%}"
-                ],
-                ["Boundary adjustments (+1)", boundary_count, f"{boundary_count/total_students:.1%}"],
-            ]
-            if threshold > 0:
-                summary_rows.append(["Further moderated to 40", further_count, f"{further_count/total_students:.1%}"])
-
-            # Per-assessment attempt counts (use numeric_raw)
-            for col in columns:
-                cnt = numeric_raw[col].notna().sum()
-                summary_rows.append([f"Attempted {col}", cnt, f"{cnt/total_students:.1%}"])
-
-            # Status distribution
-            for st_label in ["Pass", "Fail", "Incomplete", "No Score"]:
-                cnt = (df["Status"] == st_label).sum()
-                summary_rows.append([st_label, cnt, f"{cnt/total_students:.1%}"])
-
-            # Grade distribution (exclude NaN)
-            for grade, cnt in df["Grade"].dropna().value_counts().sort_index().items():
-                summary_rows.append([f"Grade {grade}", int(cnt), f"{cnt/total_students:.1%}"])
-
-            summary_df = pd.DataFrame(summary_rows, columns=["Metric", "Count", "Percentage"])
-            st.subheader("📋 Summary Table")
-            st.dataframe(summary_df, use_container_width=True)
-
-            # ---------- Preview moderated results (final) ----------
-            st.subheader("Moderated Results Preview")
-            show_cols = ["First name", "Last name", update_field, "ModeratedExamScore", "RawScore", "ModeratedTotalScore", "Grade", "Status"]
-            available_show_cols = [c for c in show_cols if c in df.columns]
-            st.dataframe(df[available_show_cols])
-
-        
-            moderated_40_list = df.loc[pre_mask].copy()
-
-            # Add the "ExamScoreBefore" column
-            moderated_40_list["ExamScoreBefore"] = numeric_raw_before.loc[pre_mask, update_field]
-
-            # Reorder columns to your desired layout
-            required_cols = [
-                "First name", "Last name", "ExamScoreBefore",
-                "ModeratedExamScore", "ModeratedTotalScore",
-                "Grade", "Status"
-            ]
-
-            # Only keep those columns (in the exact order)
-            moderated_40_list = moderated_40_list[[c for c in required_cols if c in moderated_40_list.columns]]
-
-            # Filter out Incomplete
-            moderated_40_list = moderated_40_list[moderated_40_list["Status"] != "Incomplete"]
+            # Cells that are neither blank, "-" nor a number, from the cached numeric view
+            failed = numeric.failed_cells(df, columns, ingest.MOODLE_PLACEHOLDERS)
+            if not failed.empty:
+                with st.expander(f"🧹 {len(failed)} cells could not be read as numbers and were treated as blank"):
+                    st.dataframe(failed.head(1000), width="stretch")
 
             # ---------- If further moderation happened: show list ----------
-            if threshold > 0 and further_count > 0 and not moderated_40_list.empty:
+            if threshold > 0 and result.further_count > 0 and not moderated_40_list.empty:
                 st.subheader("🔄 Students Moderated to 40")
-                st.dataframe(moderated_40_list.head(100), use_container_width=True)
-
-
-                # ---- Overall before vs after summary (status & grade) ----
-                st.subheader("📊 Overall Before vs After Summary")
-                import matplotlib.pyplot as plt
-                import numpy as np
+                st.dataframe(moderated_40_list.head(100), width="stretch")
 
-                # ==============================
-                # STATUS DISTRIBUTION
-                # ==============================
-                if "Status" not in df_before.columns:
-                    df_before["Status"] = df_before.apply(classify_status_row, axis=1)
+                with profiler.stage("charts"):
+                    import numpy as np
+                    import matplotlib.pyplot as plt
 
-                if "Status" not in df.columns:
-                    df["Status"] = df.apply(classify_status_row, axis=1)
+                    # ---- Overall before vs after summary (status & grade) ----
+                    st.subheader("📊 Overall Before vs After Summary")
 
-                # Define all possible statuses
-                all_statuses = ["Pass", "Fail", "Incomplete", "No Score"]
+                    # ==============================
+                    # STATUS DISTRIBUTION
+                    # ==============================
+                    all_statuses = moodle.STATUSES
+                    before_counts, after_counts = moodle.status_comparison(result)
 
-                # Count values and reindex to include all statuses (fill missing with 0)
-                before_counts = df_before["Status"].value_counts().reindex(all_statuses, fill_value=0)
-                after_counts = df["Status"].value_counts().reindex(all_statuses, fill_value=0)
-
-                # ==============================
-                # GRADE DISTRIBUTION
-                # ==============================
-                grade_fig = None
-                if "Grade" in df_before.columns and "Grade" in df.columns:
-                    grades_all = sorted(
-                        set(df_before["Grade"].dropna().astype(str).unique()) |
-                        set(df["Grade"].dropna().astype(str).unique())
-                    )
-
-                    before_grade = df_before["Grade"].astype(str).value_counts().reindex(grades_all, fill_value=0)
-                    after_grade = df["Grade"].astype(str).value_counts().reindex(grades_all, fill_value=0)
+                    # ==============================
+                    # GRADE DISTRIBUTION
+                    # ==============================
+                    grades_all, before_grade, after_grade = moodle.grade_comparison(result)
 
                     # Build grade chart
                     xg = np.arange(len(grades_all))
@@ -292,133 +239,46 @@ if st.button("Moderate Result"):
                     axg.set_xticklabels(grades_all)
                     axg.legend()
 
-                else:
-                    st.warning("⚠️ 'Grade' column not found in one of the dataframes. Skipping grade comparison.")
-
-                # ==============================
-                # SHOW SIDE BY SIDE
-                # ==============================
-                col1, col2 = st.columns(2)
-
-                # Status chart
-                with col1:
-                    xs = np.arange(len(all_statuses))
-                    width = 0.35
-                    status_fig, axs = plt.subplots(figsize=(6, 5))
-                    bars1 = axs.bar(xs - width/2, before_counts, width, label="Before")
-                    bars2 = axs.bar(xs + width/2, after_counts, width, label="After")
-
-                    for bar in bars1 + bars2:
-                        height = bar.get_height()
-                        axs.annotate(f"{height}",
-                                    xy=(bar.get_x() + bar.get_width() / 2, height),
-                                    xytext=(0, 3),
-                                    textcoords="offset points",
-                                    ha="center", va="bottom")
-
-                    axs.set_title("📊 Status Distribution Change")
-                    axs.set_xticks(xs)
-                    axs.set_xticklabels(all_statuses)
-                    axs.legend()
-
-                    st.pyplot(status_fig)
-
-                # Grade chart
-                with col2:
-                    if grade_fig:
+                    # ==============================
+                    # SHOW SIDE BY SIDE
+                    # ==============================
+                    col1, col2 = st.columns(2)
+
+                    # Status chart
+                    with col1:
+                        xs = np.arange(len(all_statuses))
+                        width = 0.35
+                        status_fig, axs = plt.subplots(figsize=(6, 5))
+                        bars1 = axs.bar(xs - width/2, before_counts, width, label="Before")
+                        bars2 = axs.bar(xs + width/2, after_counts, width, label="After")
+
+                        for bar in bars1 + bars2:
+                            height = bar.get_height()
+                            axs.annotate(f"{height}",
+                                        xy=(bar.get_x() + bar.get_width() / 2, height),
+                                        xytext=(0, 3),
+                                        textcoords="offset points",
+                                        ha="center", va="bottom")
+
+                        axs.set_title("📊 Status Distribution Change")
+                        axs.set_xticks(xs)
+                        axs.set_xticklabels(all_statuses)
+                        axs.legend()
+
+                        st.pyplot(status_fig)
+
+                    # Grade chart
+                    with col2:
                         st.pyplot(grade_fig)
         except Exception as e:
             st.error(f"No charts to be generated for this moderation.")
 
-
         # ---------- Prepare downloadable file ----------
-        # df_download = df.copy()
-        # # Ensure the moderated final score is in the selected column (but preserve blanks if they were blanks)
-        # df_download[update_field] = df["ModeratedExamScore"].combine_first(df_download[update_field])
-
-        # # drop helper cols that you don't want in final export (optional)
-        # helper_cols = ["RawScore", "ModeratedTotalScore", "ModeratedExamScore", "BoundaryAdjusted", "Status", "Grade"]
-        # to_drop = [c for c in helper_cols if c in df_download.columns]
-        # df_download_export = df_download.drop(columns=to_drop)
-
-        # st.success("✅ Moderation complete — download below.")
-        # csv = df_download_export.to_csv(index=False).encode("utf-8")
-        # st.download_button("Download CSV", csv, "moderated_results.csv", "text/csv")
-
-
-        # # ---------- Prepare downloadable file ----------
-        # df_download = df.copy()
-        # # Ensure the moderated final score is in the selected column (but preserve blanks if they were blanks)
-        # df_download[update_field] = df["ModeratedExamScore"].combine_first(df_download[update_field])
-
-        # # drop helper cols that you don't want in final export (optional)
-        # helper_cols = ["RawScore", "ModeratedTotalScore", "ModeratedExamScore", "BoundaryAdjusted", "Status", "Grade"]
-        # to_drop = [c for c in helper_cols if c in df_download.columns]
-        # df_download_export = df_download.drop(columns=to_drop)
-
-        # st.success("✅ Moderation complete — download below.")
-
-        # if uploaded_file is not None:
-        #     base_name, _ = os.path.splitext(uploaded_file.name)
-
-        #     # Let the user choose the output format
-        #     download_format = st.radio(
-        #         "📂 Choose download format:",
-        #         ("CSV", "Excel (.xlsx)"),
-        #         horizontal=True
-        #     )
-
-        #     if download_format == "Excel (.xlsx)":
-        #         file_name = f"{base_name}_ModeratedResults.xlsx"
-
-        #         output = BytesIO()
-        #         with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        #             df_download_export.to_excel(writer, index=False, sheet_name="Moderated Results")
-        #         processed_data = output.getvalue()
-
-        #         st.download_button(
-        #             label="⬇️ Download Moderated Excel",
-        #             data=processed_data,
-        #             file_name=file_name,
-        #             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        #         )
-
-        #     else:  # CSV
-        #         file_name = f"{base_name}_ModeratedResults.csv"
-
-        #         csv_data = df_download_export.to_csv(index=False).encode("utf-8")
-        #         st.download_button(
-        #             label="⬇️ Download Moderated CSV",
-        #             data=csv_data,
-        #             file_name=file_name,
-        #             mime="text/csv",
-        #         )
-
-
-        # ---------- Prepare downloadable file ----------
-        df_download = df.copy()
-        # Ensure the moderated final score is in the selected column (but preserve blanks if they were blanks)
-        df_download[update_field] = df["ModeratedExamScore"].combine_first(df_download[update_field])
-
-        # drop helper cols that you don't want in final export (optional)
-        helper_cols = ["RawScore", "ModeratedTotalScore", "ModeratedExamScore", "BoundaryAdjusted", "Status", "Grade"]
-        to_drop = [c for c in helper_cols if c in df_download.columns]
-        df_download_export = df_download.drop(columns=to_drop)
-
-        # 🔹 Filter rows: keep only students with non-null scores in all selected columns
-        if columns:  # only filter if user selected columns
-            # Convert to numeric where possible, errors='coerce' makes non-numeric values into NaN
-            df_selected = df_download_export[columns].apply(pd.to_numeric, errors="coerce")
-
-            # Keep only rows where all selected columns have valid (non-NaN) scores
-            mask = df_selected.notna().all(axis=1)
-            df_download_export = df_download_export[mask]
-
-
+        # Export bytes are only built when a download is clicked, then cached for this result
         st.success("✅ Moderation complete — download below.")
 
-        if uploaded_file is not None:
-            base_name, _ = os.path.splitext(uploaded_file.name)
+        if st.session_state.df_name is not None:
+            base_name, _ = os.path.splitext(st.session_state.df_name)
 
             # Let the user choose the output format
             download_format = st.radio(
@@ -426,30 +286,35 @@ if st.button("Moderate Result"):
                 ("CSV", "Excel (.xlsx)"),
                 horizontal=True
             )
+            fmt = "xlsx" if download_format == "Excel (.xlsx)" else "csv"
+            label = "⬇️ Download Moderated Excel" if fmt == "xlsx" else "⬇️ Download Moderated CSV"
+
+            def build_export():
+                if source is None:
+                    return moodle.export_frame(result)
+                # The untouched columns are parsed only now, when the file is written
+                full, _ = ingest.load_bytes(*source)
+                return moodle.export_frame(result, full)
+
+            st.download_button(
+                label=label,
+                data=profiler.deferred(
+                    export.deferred(params_key, fmt, build_export, "Moderated Results"),
+                    f"export_{fmt}"
+                ),
+                file_name=f"{base_name}_ModeratedResults.{fmt}",
+                mime=export.MIME_TYPES[fmt],
+            )
 
-            if download_format == "Excel (.xlsx)":
-                file_name = f"{base_name}_ModeratedResults.xlsx"
-
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                    df_download_export.to_excel(writer, index=False, sheet_name="Moderated Results")
-                processed_data = output.getvalue()
-
-                st.download_button(
-                    label="⬇️ Download Moderated Excel",
-                    data=processed_data,
-                    file_name=file_name,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                )
-
-            else:  # CSV
-                file_name = f"{base_name}_ModeratedResults.csv"
-
-                csv_data = df_download_export.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    label="⬇️ Download Moderated CSV",
-                    data=csv_data,
-                    file_name=file_name,
-                    mime="text/csv",
-                )
+            # Every changed cell with its old and new value and why it changed
+            st.download_button(
+                label=f"🧾 Download Change Log ({len(result.ledger)} changes)",
+                data=profiler.deferred(
+                    export.deferred(memo.fingerprint(params_key, "audit"), fmt, lambda: moodle.audit_frame(result), "Change Log"),
+                    f"export_audit_{fmt}"
+                ),
+                file_name=f"{base_name}_ChangeLog.{fmt}",
+                mime=export.MIME_TYPES[fmt],
+            )
 
+ui.diagnostics(profiler)
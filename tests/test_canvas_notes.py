@@ -0,0 +1,78 @@
+"""adjust_scores() against the original row-by-row adjust_row().
+
+The "Adjusted by ..." notes print the shortfall as pandas' row-wise apply
+typed it ("3" for integer rows, "3.0" once a float is involved), which
+engine.canvas and engine.numeric reproduce from dtype rules. These cases
+keep that in step with the installed pandas.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine import canvas
+
+PASS_MARK = 40
+
+
+def original_adjustment(df, score_columns, threshold):
+    # The Canvas page's adjustment before it was vectorized
+    valid_df = df[df[score_columns].notna().all(axis=1)].copy()
+
+    def adjust_row(row):
+        values = row[score_columns].fillna(0)
+        total = values.sum()
+        if (total >= threshold and total < PASS_MARK):
+            shortfall = PASS_MARK - total
+            values.iloc[-1] = min(values.iloc[-1] + shortfall, PASS_MARK)
+            adjusted_total = values.sum()
+            return pd.Series([adjusted_total, f"Adjusted by {shortfall}"])
+        else:
+            return pd.Series([total, "No adjustment needed"])
+
+    valid_df[score_columns] = valid_df[score_columns].apply(pd.to_numeric, errors='coerce')
+    valid_df[["Adjusted Total", "Adjustment Note"]] = valid_df.apply(adjust_row, axis=1)
+    return valid_df[["Adjusted Total", "Adjustment Note"]]
+
+
+def gradebook(kind, n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    ca1 = rng.integers(0, 15, n)
+    ca2 = rng.integers(0, 15, n)
+    exam = rng.integers(0, 30, n)
+    df = pd.DataFrame({"Section": rng.choice(["A", "B"], n)})
+    if kind == "int":
+        df["CA1"], df["CA2"], df["Exam"] = ca1, ca2, exam
+    elif kind == "float":
+        df["CA1"], df["CA2"], df["Exam"] = ca1 + 0.5, ca2.astype(float), exam.astype(float)
+    elif kind == "mixed":
+        # Text column holding ints and decimals next to an integer column
+        df["CA1"] = ca1
+        df["CA2"] = [f"{v}.5" if v % 3 == 0 else str(v) for v in ca2]
+        df["Exam"] = exam
+    elif kind == "dash":
+        # Canvas "-" is a present score that counts as 0
+        df["CA1"] = np.where(ca1 % 5 == 0, "-", ca1.astype(str)).astype(object)
+        df["CA2"] = ca2
+        df["Exam"] = exam
+    if kind != "int":
+        # Some students have not taken every assessment; an integer column with gaps would read as float
+        gappy = {"float": "CA2", "mixed": "CA2", "dash": "CA1"}[kind]
+        df[gappy] = df[gappy].astype(object).where(rng.random(n) > 0.1, None)
+    return df
+
+
+@pytest.mark.parametrize("kind", ["int", "float", "mixed", "dash"])
+@pytest.mark.parametrize("threshold", [0, 30, 38])
+def test_adjust_scores_matches_adjust_row(kind, threshold):
+    df = gradebook(kind)
+    # The mixed case keeps its text column as object; the others take their natural dtypes
+    if kind != "mixed":
+        df = df.infer_objects()
+    score_columns = ["CA1", "CA2", "Exam"]
+    expected = original_adjustment(df, score_columns, threshold)
+
+    rows = np.flatnonzero(df[score_columns].notna().all(axis=1).to_numpy())
+    actual = canvas.adjust_scores(df, score_columns, threshold, rows)
+
+    assert actual["Adjustment Note"].tolist() == expected["Adjustment Note"].tolist()
+    np.testing.assert_allclose(actual["Adjusted Total"].to_numpy(dtype=float), expected["Adjusted Total"].to_numpy(dtype=float))
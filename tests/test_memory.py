@@ -0,0 +1,17 @@
+"""Peak memory of each page's pipeline against its frame budget.
+
+Each page runs on a synthetic export in fresh processes (benchmarks.memory);
+PEAK_FRAMES there lists what a page may hold beyond its loaded frame.
+"""
+import sys
+
+import pytest
+
+from benchmarks import memory
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="peaks are read from /proc")
+@pytest.mark.parametrize("page", sorted(memory.PAGES))
+def test_peak_within_budget(page):
+    result = memory.marginal(page, memory.DEFAULT_ROWS, seed=0)
+    assert result["marginal_ratio"] <= memory.PEAK_BUDGET[page], memory.PEAK_FRAMES[page]
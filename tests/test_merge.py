@@ -0,0 +1,81 @@
+"""engine.merge against a plain pandas outer join on the student identity.
+
+merge_frames() scatters every file into one hash index instead of chaining
+merges; these cases check it finds the same students and scores, reports
+the same unmatched and skipped rows, and writes integer marks unchanged.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine import export, merge
+
+
+def reference_merge(frames, key_column):
+    # Chained outer merges on the normalized key, skipping blank and repeated keys
+    merged = None
+    for df in frames.values():
+        df = df.copy()
+        df["_key"] = df[key_column].astype("string").str.strip().str.casefold()
+        df = df[df["_key"].notna() & (df["_key"] != "")]
+        df = df[~df["_key"].duplicated()]
+        scores = df[[col for col in df.columns if col not in merge.IDENTITY_COLUMNS]]
+        merged = scores if merged is None else merged.merge(scores, on="_key", how="outer", sort=False)
+    return merged.set_index("_key")
+
+
+def exports(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    emails = np.array([f"S{i}@uni.edu" for i in range(n)], dtype=object)
+    quizzes = pd.DataFrame({
+        "First name": [f"F{i}" for i in range(n)],
+        "Email address": emails,
+        "Quiz 1": rng.integers(0, 20, n),
+        "Quiz 2": rng.integers(0, 20, n) + 0.5,
+    })
+    # The exam export spells emails differently, misses some students and adds others
+    exam_rows = rng.permutation(n)[: n - 40]
+    exam_emails = np.concatenate([[f" {e.lower()} " for e in emails[exam_rows]], [f"new{i}@uni.edu" for i in range(15)]])
+    exams = pd.DataFrame({
+        "Email address": exam_emails,
+        "Exam": rng.integers(0, 60, len(exam_emails)),
+    })
+    # A blank identity and a student listed twice are skipped
+    exams.loc[0, "Email address"] = None
+    exams.loc[1, "Email address"] = exams.loc[2, "Email address"]
+    return {"quizzes.csv": quizzes, "exam.csv": exams}
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_merge_matches_outer_join(seed):
+    frames = exports(seed=seed)
+    result = merge.merge_frames(frames, ["Email address"])
+    expected = reference_merge(frames, "Email address")
+
+    keys = merge.student_keys(result.df, ["Email address"])
+    actual = result.df.set_axis(keys.to_numpy())[expected.columns]
+    assert len(actual) == len(expected)
+    assert set(actual.index) == set(expected.index)
+    actual = actual.loc[expected.index]
+    for col in expected.columns:
+        np.testing.assert_allclose(actual[col].to_numpy(dtype=float, na_value=np.nan), expected[col].to_numpy(dtype=float))
+
+    both = expected.notna().all(axis=1).sum()
+    assert result.matched == both
+    assert len(result.unmatched) == len(expected) - both
+    assert sorted(result.skipped["Reason"]) == ["Blank identity", "Repeated within file"]
+
+
+def test_merge_keeps_integer_marks():
+    frames = exports()
+    result = merge.merge_frames(frames, ["Email address"])
+    written = pd.read_csv(io.BytesIO(export.to_csv_bytes(result.df)), dtype=str)
+    # Students missing from one file leave blanks, not 7.0 for 7
+    for col in ["Quiz 1", "Exam"]:
+        assert not written[col].dropna().str.contains(r"\.").any(), col
+
+
+def test_repeated_file_names_are_kept_apart():
+    assert merge.file_labels(["grades.csv", "grades.csv", "exam.csv"]) == ["grades.csv", "grades.csv (2)", "exam.csv"]
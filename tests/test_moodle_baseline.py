@@ -0,0 +1,124 @@
+"""engine.moodle against the Moodle page's original row-by-row moderation.
+
+The engine rewrote boundary moderation, further moderation, status and the
+threshold what-if with whole-column operations. These cases run the page's
+original logic on the same exports and compare grades, statuses, the
+moderated export and the sweep counts at every threshold.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from engine import moodle
+
+COLUMNS = ["Quiz", "Assignment", "Exam"]
+
+
+def round_boundary(score):
+    if score in [39, 44, 49, 59, 69]:
+        return score + 1
+    return score
+
+
+def assign_grade(score):
+    if score < 40:
+        return "F"
+    elif score < 45:
+        return "E"
+    elif score < 50:
+        return "D"
+    elif score < 60:
+        return "C"
+    elif score < 70:
+        return "B"
+    return "A"
+
+
+def original_moderation(df, columns, update_field, threshold):
+    # The Moodle page's moderation before it moved to engine.moodle
+    df = df.copy()
+    numeric_raw = df[columns].apply(pd.to_numeric, errors="coerce")
+    df["RawScore"] = numeric_raw.fillna(0).sum(axis=1)
+    df["ModeratedTotalScore"] = df["RawScore"].apply(round_boundary)
+    df["Grade"] = np.where(numeric_raw.notna().all(axis=1), df["ModeratedTotalScore"].apply(assign_grade), np.nan)
+
+    further = pd.Series(False, index=df.index)
+    if threshold > 0:
+        further = ((df["Grade"] == "F") & (df["ModeratedTotalScore"] >= threshold)
+                   & (df["ModeratedTotalScore"] < 40) & numeric_raw[update_field].notna())
+        if further.any():
+            diff = 40 - df.loc[further, "ModeratedTotalScore"]
+            numeric_raw.loc[further, update_field] = numeric_raw.loc[further, update_field].fillna(0) + diff
+            df["RawScore"] = numeric_raw.fillna(0).sum(axis=1)
+            df["ModeratedTotalScore"] = df["RawScore"].apply(round_boundary)
+            df["Grade"] = np.where(numeric_raw.notna().all(axis=1), df["ModeratedTotalScore"].apply(assign_grade), np.nan)
+
+    df["ModeratedExamScore"] = np.where(
+        numeric_raw[update_field].notna(),
+        numeric_raw[update_field] + (df["ModeratedTotalScore"] - df["RawScore"]),
+        np.nan
+    )
+    df[update_field] = df["ModeratedExamScore"].combine_first(df[update_field])
+
+    def classify_status_row(r):
+        nr = numeric_raw.loc[r.name]
+        if nr.isna().all():
+            return "No Score"
+        elif nr.isna().any():
+            return "Incomplete"
+        return "Pass" if r["ModeratedTotalScore"] >= 40 else "Fail"
+
+    df["Status"] = df.apply(classify_status_row, axis=1)
+
+    export = df.drop(columns=[c for c in moodle.HELPER_COLS if c in df.columns])
+    export = export[export[columns].apply(pd.to_numeric, errors="coerce").notna().all(axis=1)]
+    return df, export, int(further.sum())
+
+
+def gradebook(n=600, seed=0, decimals=True):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "First name": [f"F{i}" for i in range(n)],
+        "Last name": [f"L{i}" for i in range(n)],
+        "Email address": [f"s{i}@x.edu" for i in range(n)],
+    })
+    for col, high in [("Quiz", 20), ("Assignment", 30), ("Exam", 50)]:
+        values = rng.integers(0, high + 1, n).astype(float)
+        if decimals:
+            values = values + rng.choice([0, 0.5, 0.25, 0.3], n)
+        values = values.astype(object)
+        # Moodle's "-" for ungraded, and blank cells
+        values[rng.random(n) < 0.1] = "-"
+        values[rng.random(n) < 0.05] = np.nan
+        df[col] = values
+    return df
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+@pytest.mark.parametrize("decimals", [True, False])
+@pytest.mark.parametrize("threshold", [0, 30, 35])
+@pytest.mark.parametrize("update_field", ["Exam", "Quiz"])
+def test_moderate_matches_original(seed, decimals, threshold, update_field):
+    df = gradebook(seed=seed, decimals=decimals)
+    expected, expected_export, further = original_moderation(df, COLUMNS, update_field, threshold)
+
+    result = moodle.moderate(df, COLUMNS, update_field, threshold)
+    assert_frame_equal(result.df[expected.columns], expected, check_dtype=False)
+    assert_frame_equal(moodle.export_frame(result), expected_export, check_dtype=False)
+    assert result.further_count == further
+
+
+@pytest.mark.parametrize("decimals", [True, False])
+def test_threshold_sweep_matches_original(decimals):
+    df = gradebook(seed=2, decimals=decimals)
+    sweep = moodle.threshold_sweep(moodle.moderate(df, COLUMNS, "Exam", 0))
+
+    for threshold in [0, 1, 20, 30, 35, 38, 39]:
+        expected, _, further = original_moderation(df, COLUMNS, "Exam", threshold)
+        row = sweep.loc[threshold]
+        assert row["Moderated to 40"] == further
+        assert row["Pass"] == (expected["Status"] == "Pass").sum()
+        grades = expected["Grade"].dropna().value_counts()
+        for label in moodle.GRADE_LABELS:
+            assert row[f"Grade {label}"] == grades.get(label, 0), (threshold, label)
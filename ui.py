@@ -0,0 +1,31 @@
+"""Streamlit pieces shared by the pages.
+
+Kept next to app.py rather than in pages/, where Streamlit would list it
+as a page, and out of engine/, which does not import Streamlit.
+"""
+import streamlit as st
+
+
+@st.fragment(run_every=0.5)
+def job_progress(job):
+    # Polls the running job; the rest of the page stays usable meanwhile
+    if job.done:
+        st.rerun()
+    if job.cancelling:
+        st.progress(job.progress, text="Cancelling…")
+        return
+    st.progress(job.progress, text=f"{job.stage or 'Waiting for a free worker'}… ({job.elapsed:.0f}s)")
+    if st.button("Cancel", key=f"cancel_{job.id}"):
+        job.cancel()
+        st.rerun()
+
+
+def diagnostics(profiler):
+    # Stage timings and memory, shown only when profiling is on for the session
+    if not profiler.enabled:
+        return
+    with st.expander("🩺 Diagnostics"):
+        st.dataframe(profiler.frame(), width="stretch")
+        if profiler.background:
+            st.caption("Recent downloads")
+            st.dataframe(profiler.background_frame(), width="stretch")